@@ -0,0 +1,167 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import fsspec
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from instrumentation import log
+
+#### Declare constants
+ARCHIVE_COMPRESSION = os.environ.get('HILTON_ARCHIVE_COMPRESSION', 'zstd')
+
+def arrow_type(series: pd.Series) -> pa.DataType:
+    """
+    explicit arrow type for a loader column, so archives never depend on arrow's inference.
+
+    Args:
+        series (pd.Series): column as returned by a load_* function.
+
+    Returns:
+        pa.DataType: arrow type to store the column as.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return pa.timestamp('us', tz='UTC') if getattr(series.dtype, 'tz', None) is not None else pa.timestamp('us')
+    if pd.api.types.is_float_dtype(series.dtype):
+        return pa.float64()
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return pa.int64()
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return pa.bool_()
+    return pa.string()
+
+def to_arrow_table(df: pd.DataFrame, schema: pa.Schema = None) -> pa.Table:
+    """
+    convert a loader DataFrame to an arrow table with explicit column types.
+
+    Args:
+        df (pd.DataFrame): table to convert.
+        schema (pa.Schema, optional): Defaults to one built with arrow_type per column.
+
+    Returns:
+        pa.Table: converted table, without the pandas index.
+    """
+    if schema is None:
+        schema = pa.schema([(col, arrow_type(df[col])) for col in df.columns])
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+def write_archive(df, saveLocation: str, schema: pa.Schema = None) -> str:
+    """
+    write one compressed parquet file for a table.
+
+    Args:
+        df (pd.DataFrame or pa.Table): table to archive, arrow tables are written as they are.
+        saveLocation (str): path without extension, local or gs://.
+        schema (pa.Schema, optional): explicit arrow schema. Defaults to to_arrow_table's.
+
+    Returns:
+        str: path written.
+    """
+    path = saveLocation + '.parquet'
+    table = df if isinstance(df, pa.Table) else to_arrow_table(df, schema)
+    with fsspec.open(path, 'wb') as f:
+        pq.write_table(table, f, compression=ARCHIVE_COMPRESSION)
+    return path
+
+def read_archive(path: str, columns: list = None) -> pd.DataFrame:
+    """
+    reload an archived table, e.g. to replay it into BigQuery.
+
+    Args:
+        path (str): parquet file written by write_archive, local or gs://.
+        columns (list, optional): only read these columns. Defaults to all.
+
+    Returns:
+        pd.DataFrame: archived table.
+    """
+    with fsspec.open(path, 'rb') as f:
+        return pq.read_table(f, columns=columns).to_pandas()
+
+class ParquetStreamWriter:
+    """
+    write a table to one parquet file a chunk at a time, holding only the current chunk in memory.
+    """
+
+    def __init__(self, saveLocation: str, schema: pa.Schema):
+        self.path = saveLocation + '.parquet'
+        self.schema = schema
+        self.rows = 0
+        self._file = fsspec.open(self.path, 'wb').open()
+        self._writer = pq.ParquetWriter(self._file, schema, compression=ARCHIVE_COMPRESSION)
+
+    def write(self, df: pd.DataFrame) -> None:
+        batch = pa.RecordBatch.from_pandas(df, schema=self.schema, preserve_index=False)
+        self._writer.write_batch(batch)
+        self.rows += batch.num_rows
+
+    def close(self) -> str:
+        """
+        finish the file.
+
+        Returns:
+            str: path written.
+        """
+        self._writer.close()
+        self._file.close()
+        return self.path
+
+class ArchiveWriter:
+    """
+    write table archives on background threads so the uploads overlap the BigQuery loads.
+
+    on_done(path) is called on the writing thread as soon as each archive is written.
+    """
+
+    def __init__(self, max_workers: int = 5, on_done=None):
+        self.max_workers = max_workers
+        self.on_done = on_done
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._pending = []
+        self.report = []
+
+    def submit(self, df, saveLocation: str, schema: pa.Schema = None) -> None:
+        log(f"archiving {saveLocation}.parquet", path=saveLocation + '.parquet', rows=len(df))
+        future = self._pool.submit(write_archive, df, saveLocation, schema)
+        if self.on_done is not None:
+            future.add_done_callback(lambda future: self._done(saveLocation + '.parquet', future))
+        self._pending.append((saveLocation, time.monotonic(), future))
+
+    def _done(self, path: str, future) -> None:
+        if future.exception() is not None:
+            return
+        # like the mirror, a failing callback never fails the archive itself
+        try:
+            self.on_done(path)
+        except Exception as e:
+            log(f"on_done failed for {path}", severity='WARNING', path=path, error=f"{type(e).__name__}: {e}")
+
+    def wait(self) -> list:
+        """
+        wait for every archive to be written.
+
+        Raises:
+            RuntimeError: if any archive could not be written.
+
+        Returns:
+            list: one dict per archive with path, seconds and error.
+        """
+        report = []
+        for saveLocation, submitted, future in self._pending:
+            stats = {'path': saveLocation + '.parquet', 'seconds': None, 'error': None}
+            try:
+                future.result()
+            except Exception as e:
+                stats['error'] = f"{type(e).__name__}: {e}"
+            stats['seconds'] = round(time.monotonic() - submitted, 3)
+            log(f"archived {stats['path']}", severity='ERROR' if stats['error'] else 'INFO', stage='archive', **stats)
+            report.append(stats)
+        self._pending = []
+        self._pool.shutdown(wait=False)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        # main.wait_for_run checkpoints the archives written even when another one failed
+        self.report = report
+
+        failed = [stats['path'] for stats in report if stats['error'] is not None]
+        if failed:
+            raise RuntimeError(f"archive write failed for {', '.join(failed)}")
+        return report
@@ -0,0 +1,189 @@
+"""
+Backfill many Service Level Reports into BigQuery.
+
+Workbooks are parsed across a process pool, their rows concatenated per hilton_* table and
+loaded with one parquet load job per table per batch. Finished files are appended to a manifest,
+so an interrupted backfill picks up where it stopped.
+Tables in HILTON_INCREMENTAL_TABLES are skipped, their change rows come from run(). The derived KPI
+and forecast horizon tables are built from each batch and loaded like the hilton_* tables.
+
+usage: python backfill.py "reports/*.xlsx" [more dirs or globs] [--workers 4] [--batch-files 50] [--manifest backfill_manifest.jsonl] [--dry-run]
+"""
+import argparse
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import pyarrow as pa
+from google.cloud import bigquery
+
+from main_local import PROJECT_ID, get_bq_credentials, is_correctFileName, get_date, infer_site
+from schemas import TABLES, load_table, arrow_schema, bigquery_schema, bigquery_table, constant_column, set_dtypes
+from workbook import open_workbook
+from gcs_io import file_md5_hexdigest
+from archive import to_arrow_table
+from bq_loader import LoadCoordinator, ensure_table
+from mirror import BIGQUERY_BACKEND, mirror_client
+from scd import INCREMENTAL_TABLES
+from main import derived_builders, submit_derived
+from instrumentation import log, span
+
+#### Declare constants
+MANIFEST = 'backfill_manifest.jsonl'
+# incremental tables hold changes diffed report by report, ingest those through run() in date order instead
+BACKFILL_TABLES = [tbl_name for tbl_name in TABLES if tbl_name not in INCREMENTAL_TABLES]
+
+def find_workbooks(patterns: list) -> list:
+    """
+    expand directories and globs into correctly named workbook paths, oldest report first.
+
+    Args:
+        patterns (list): directories, globs or file paths.
+
+    Returns:
+        list: absolute paths.
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.xls*')
+        for path in glob.glob(pattern):
+            filename = os.path.basename(path)
+            if not is_correctFileName(filename):
+                continue
+            try:
+                get_date(filename)
+            except (IndexError, ValueError):
+                log(f"{filename} has no report date in its name, SKIPPING it", severity='WARNING', filename=filename)
+                continue
+            paths.add(os.path.abspath(path))
+    return sorted(paths, key=lambda path: (get_date(os.path.basename(path)), path))
+
+def read_manifest(manifest: str) -> set:
+    """
+    filenames already loaded by earlier runs.
+    """
+    if not os.path.exists(manifest):
+        return set()
+    with open(manifest) as f:
+        return {json.loads(line)['filename'] for line in f if line.strip()}
+
+def append_manifest(manifest: str, done: list) -> None:
+    with open(manifest, 'a') as f:
+        for filename, file_contents_md5 in done:
+            f.write(json.dumps({
+                'filename': filename,
+                'file_contents_md5': file_contents_md5,
+                'completed_utc': datetime.now(timezone.utc).isoformat(),
+            }) + '\n')
+
+def parse_file(path: str) -> tuple:
+    """
+    parse every table of one workbook into arrow. Runs in a worker process.
+
+    Args:
+        path (str): workbook path.
+
+    Returns:
+        tuple: (filename, file_contents_md5, {tbl_name: pa.Table})
+    """
+    filename = os.path.basename(path)
+    da_date = get_date(filename)
+    site = infer_site(filename)
+    file_contents_md5 = file_md5_hexdigest(path)
+    upload_utc_dt = datetime.now(timezone.utc)
+
+    tables = {}
+    with open_workbook(path) as workbook:
+        for tbl_name in BACKFILL_TABLES:
+            _, df = load_table(workbook, tbl_name, da_date, site)
+            df['upload_utc_dt'] = upload_utc_dt
+            df['filename'] = constant_column(filename, len(df))
+            df['file_contents_md5'] = constant_column(file_contents_md5, len(df))
+            tables[tbl_name] = to_arrow_table(df, arrow_schema(tbl_name))
+    return (filename, file_contents_md5, tables)
+
+def get_bq_client() -> bigquery.Client:
+    if BIGQUERY_BACKEND == 'mirror':
+        return mirror_client()
+    # get_bq_credentials hands back a client already when there is no key file
+    credentials = get_bq_credentials()
+    if isinstance(credentials, bigquery.Client):
+        return credentials
+    return bigquery.Client(project=PROJECT_ID, credentials=credentials)
+
+def backfill(patterns: list, workers: int = None, batch_files: int = 50, manifest: str = MANIFEST, dry_run: bool = False) -> None:
+    """
+    load every not yet loaded workbook matching patterns.
+
+    Args:
+        patterns (list): directories, globs or file paths.
+        workers (int, optional): parser processes. Defaults to the CPU count.
+        batch_files (int, optional): files concatenated into each round of load jobs. Defaults to 50.
+        manifest (str, optional): jsonl file of finished files. Defaults to MANIFEST.
+        dry_run (bool, optional): parse only, load nothing and leave the manifest alone. Defaults to False.
+    """
+    done = read_manifest(manifest)
+    paths = [path for path in find_workbooks(patterns) if os.path.basename(path) not in done]
+    log(f"backfilling {len(paths)} workbooks ({len(done)} already done)", workbooks=len(paths), already_done=len(done))
+    if INCREMENTAL_TABLES:
+        log(f"not backfilling incremental tables {', '.join(INCREMENTAL_TABLES)}", severity='WARNING', skipped_tables=INCREMENTAL_TABLES)
+    if not paths:
+        return
+
+    client = None if dry_run else get_bq_client()
+    loads = None if dry_run else LoadCoordinator(client)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(paths), batch_files):
+            batch = paths[start:start + batch_files]
+            parsed = {tbl_name: [] for tbl_name in BACKFILL_TABLES}
+            batch_done = []
+            builders = [] if dry_run else derived_builders()
+            with span('backfill_parse', files=len(batch)):
+                futures = [(path, pool.submit(parse_file, path)) for path in batch]
+                for path, future in futures:
+                    try:
+                        filename, file_contents_md5, tables = future.result()
+                    except Exception as e:
+                        # one unreadable workbook must not hold back the rest, it stays out of the manifest
+                        log(f"could not parse {os.path.basename(path)}, SKIPPING it", severity='ERROR', filename=os.path.basename(path), error=f"{type(e).__name__}: {e}")
+                        continue
+                    for tbl_name, table in tables.items():
+                        parsed[tbl_name].append(table)
+                        # the builders read frames with the dtypes load_table gives them, as in run()
+                        if any(tbl_name in builder.sources for builder in builders):
+                            df = set_dtypes(table.to_pandas(), tbl_name)
+                            for builder in builders:
+                                builder.add(tbl_name, df)
+                    batch_done.append((filename, file_contents_md5))
+
+            with span('backfill_load', files=len(batch_done)) as metrics:
+                for tbl_name, tables in [(tbl_name, tables) for tbl_name, tables in parsed.items() if tables]:
+                    table = pa.concat_tables(tables)
+                    metrics[tbl_name] = table.num_rows
+                    if loads is not None:
+                        ensure_table(client, bigquery_table(tbl_name, f"{client.project}.hilton.{tbl_name}"))
+                        job_config = bigquery.LoadJobConfig(write_disposition="WRITE_APPEND", schema=bigquery_schema(tbl_name))
+                        # rows already loaded for these reports, e.g. by run(), are replaced rather than duplicated
+                        slices = [(get_date(filename), infer_site(filename)) for filename, _ in batch_done]
+                        loads.submit_arrow(table, f'hilton.{tbl_name}', job_config=job_config, replace=slices)
+                if loads is not None:
+                    # KPI and horizon tables of the batch, replacing the same report slices
+                    submit_derived(loads, client, builders)
+                    loads.wait()
+
+            if not dry_run:
+                append_manifest(manifest, batch_done)
+            log(f"finished {start + len(batch)} of {len(paths)} workbooks", finished=start + len(batch), workbooks=len(paths))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('patterns', nargs='+', help='directories, globs or workbook paths')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch-files', type=int, default=50)
+    parser.add_argument('--manifest', default=MANIFEST)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+    backfill(args.patterns, args.workers, args.batch_files, args.manifest, args.dry_run)
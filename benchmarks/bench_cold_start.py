@@ -0,0 +1,41 @@
+"""
+Measure cold starts of main.py in fresh interpreters: importing the module, rejecting a
+wrongly named file, and the imports a correctly named file then pulls in.
+
+usage: python benchmarks/bench_cold_start.py [repeats]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# each snippet runs in a new interpreter and prints its elapsed seconds and whether pandas got loaded
+SNIPPETS = {
+    'import main': "import main",
+    'reject wrong filename': "import main; main.run({'name': 'notes.txt', 'bucket': 'b'}, None)",
+    'heavy imports (accepted file)': "import main, pandas, pyarrow, workbook, schemas, bq_loader, archive; "
+                                     "from google.cloud import storage, bigquery",
+}
+
+def time_snippet(snippet: str) -> dict:
+    code = (
+        "import io, contextlib, json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"with contextlib.redirect_stdout(io.StringIO()):\n    {snippet}\n"
+        "print(json.dumps({'seconds': time.perf_counter() - start, 'pandas_loaded': 'pandas' in sys.modules}))\n"
+    )
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main(repeats: int = 5) -> None:
+    print(f"{'case':<32} {'median_ms':>10} {'min_ms':>8} {'pandas loaded':>14}")
+    for name, snippet in SNIPPETS.items():
+        results = [time_snippet(snippet) for _ in range(repeats)]
+        seconds = [result['seconds'] for result in results]
+        print(f"{name:<32} {statistics.median(seconds) * 1000:10.1f} {min(seconds) * 1000:8.1f} {str(results[0]['pandas_loaded']):>14}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
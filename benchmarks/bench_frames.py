@@ -0,0 +1,82 @@
+"""
+Compare the memory and serialisation cost of the tables run() hands to BigQuery and the archives:
+python-object frames converted twice (once for the archive, once inside load_table_from_dataframe)
+against arrow-backed strings, categorical constant columns and a single arrow conversion.
+
+usage: python benchmarks/bench_frames.py [--rows 100000] [--reference-rows 2000] [--workbook path.xlsx]
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from main import TABLE_LOADERS, add_upload_columns, get_date, infer_site
+from schemas import arrow_schema
+from workbook import iter_tables
+from archive import to_arrow_table
+
+def as_objects(df):
+    # what run() held before: every text column, and each broadcast constant, as python objects
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype.kind not in 'fiMm':
+            df[col] = df[col].astype(object)
+    return df
+
+def serialise(table: pa.Table) -> tuple:
+    buffer = io.BytesIO()
+    start = time.perf_counter()
+    pq.write_table(table, buffer)
+    return time.perf_counter() - start, buffer.getbuffer().nbytes
+
+def measure(df, tbl_name: str, conversions: int, infer: bool) -> dict:
+    start = time.perf_counter()
+    for _ in range(conversions):
+        # load_table_from_dataframe converts without our schema, the archive with it
+        table = pa.Table.from_pandas(df, preserve_index=False) if infer else to_arrow_table(df, arrow_schema(tbl_name))
+    convert_seconds = time.perf_counter() - start
+    write_seconds, parquet_bytes = serialise(table)
+    return {
+        'frame_mb': df.memory_usage(deep=True).sum() / 1024 / 1024,
+        'convert_s': convert_seconds,
+        'write_s': write_seconds,
+        'arrow_mb': table.nbytes / 1024 / 1024,
+        'parquet_mb': parquet_bytes / 1024 / 1024,
+    }
+
+def compare(workbook_path: str) -> None:
+    filename = os.path.basename(workbook_path)
+    upload = {
+        'filename': filename,
+        'file_contents_md5': '0' * 32,
+        'now_utc': datetime.now(timezone.utc),
+    }
+    print(f"{'table':<22} {'path':<8} {'frame_mb':>9} {'convert_s':>10} {'write_s':>8} {'arrow_mb':>9} {'parquet_mb':>10}")
+    for tbl_name, df in iter_tables(list(TABLE_LOADERS.values()), workbook_path, get_date(filename), infer_site(filename)):
+        add_upload_columns(df, upload)
+        for path, frame, conversions, infer in (('objects', as_objects(df), 2, True), ('arrow', df, 1, False)):
+            stats = measure(frame, tbl_name, conversions, infer)
+            print(f"{tbl_name:<22} {path:<8} {stats['frame_mb']:>9.1f} {stats['convert_s']:>10.3f} {stats['write_s']:>8.3f} "
+                  f"{stats['arrow_mb']:>9.1f} {stats['parquet_mb']:>10.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--reference-rows', type=int, default=2000)
+    parser.add_argument('--workbook', default=None, help='existing workbook to use instead of generating one')
+    args = parser.parse_args()
+
+    workbook_path = args.workbook
+    if workbook_path is None:
+        from synthetic_workbook import generate_workbook
+        workbook_path = generate_workbook(tempfile.mkdtemp(), rows=args.rows, reference_rows=args.reference_rows)
+        print(f"generated {workbook_path}")
+    compare(workbook_path)
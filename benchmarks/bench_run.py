@@ -0,0 +1,73 @@
+"""
+Run main.run() end to end against a synthetic workbook and the in-process GCS/BigQuery fakes,
+then report wall time, throughput and peak memory per stage from the structured stage logs.
+
+usage: python benchmarks/bench_run.py [--rows 100000] [--reference-rows 2000] [--workbook path.xlsx] [--tracemalloc]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+#### Declare constants
+BUCKET = 'hilton-bench'
+
+def run_once(workbook_path: str) -> list:
+    """
+    upload workbook_path to the fake bucket, run main.run() on its finalize event and return the stage metrics.
+    """
+    import main
+    from fakes import fake_cloud, FakeStorageClient
+
+    filename = os.path.basename(workbook_path)
+    captured = io.StringIO()
+    with fake_cloud(main):
+        FakeStorageClient().bucket(BUCKET).blob(filename).upload_from_filename(workbook_path)
+        with contextlib.redirect_stdout(captured):
+            main.run({'name': filename, 'bucket': BUCKET}, None)
+
+    stages = []
+    for line in captured.getvalue().splitlines():
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if 'stage' in entry:
+            stages.append(entry)
+    return stages
+
+def report(stages: list) -> None:
+    print(f"{'stage':<20} {'table':<30} {'rows':>9} {'wall_s':>8} {'cpu_s':>8} {'rows/s':>10} {'rss_mb':>8} {'traced_mb':>9}")
+    for entry in stages:
+        rows = entry.get('rows')
+        wall = entry.get('wall_seconds', entry.get('seconds'))
+        throughput = f"{rows / wall:10.0f}" if rows and wall else f"{'':>10}"
+        print(f"{entry['stage']:<20} {entry.get('table') or os.path.basename(entry.get('path', '')):<30.30} {str(rows or ''):>9} "
+              f"{wall if wall is not None else '':>8} {entry.get('cpu_seconds', ''):>8} {throughput} "
+              f"{entry.get('peak_rss_mb', ''):>8} {entry.get('peak_traced_mb', ''):>9}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--reference-rows', type=int, default=2000)
+    parser.add_argument('--workbook', default=None, help='existing workbook to use instead of generating one')
+    parser.add_argument('--tracemalloc', action='store_true', help='also report traced python memory per stage')
+    args = parser.parse_args()
+
+    # read by the modules at import time
+    os.environ.setdefault('HILTON_LEDGER', 'none')
+    if args.tracemalloc:
+        os.environ['HILTON_TRACEMALLOC'] = '1'
+
+    workbook_path = args.workbook
+    if workbook_path is None:
+        from synthetic_workbook import generate_workbook
+        workbook_path = generate_workbook(tempfile.mkdtemp(), rows=args.rows, reference_rows=args.reference_rows)
+        print(f"generated {workbook_path}")
+    report(run_once(workbook_path))
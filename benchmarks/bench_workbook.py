@@ -0,0 +1,63 @@
+"""
+Compare the old five separate pd.read_excel calls against one shared workbook
+and against parsing the sheets across a process pool.
+
+usage: python benchmarks/bench_workbook.py "<Site> Service Level Report - DDMMYYYY.xlsx" [repeats]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import (get_date, infer_site, load_condensed_masterdata, load_service_level_data,
+                  load_servicegroup_data, load_forecast_data, load_customer_data)
+from workbook import open_workbook, available_engines, iter_tables
+
+func_2_run = [load_condensed_masterdata, load_service_level_data, load_servicegroup_data, load_forecast_data, load_customer_data]
+
+def separate_reads(file_path: str, da_date, site: str) -> int:
+    rows = 0
+    for func in func_2_run:
+        tbl_name, df = func(file_path, da_date, site)
+        rows += len(df)
+    return rows
+
+def single_pass(file_path: str, da_date, site: str, engine: str = None) -> int:
+    rows = 0
+    with open_workbook(file_path, engine=engine) as workbook:
+        for func in func_2_run:
+            tbl_name, df = func(workbook, da_date, site)
+            rows += len(df)
+    return rows
+
+def process_pool(file_path: str, da_date, site: str, max_workers: int) -> int:
+    rows = 0
+    for tbl_name, df in iter_tables(func_2_run, file_path, da_date, site, max_workers=max_workers):
+        rows += len(df)
+    return rows
+
+def best_of(fn, repeats: int, *args) -> tuple:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        rows = fn(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), rows
+
+def main(file_path: str, repeats: int = 3) -> None:
+    filename = os.path.basename(file_path)
+    da_date = get_date(filename)
+    site = infer_site(filename)
+
+    baseline, rows = best_of(separate_reads, repeats, file_path, da_date, site)
+    print(f"{'five separate reads':<28} {baseline:8.3f}s  {rows} rows")
+    for engine in available_engines():
+        elapsed, rows = best_of(single_pass, repeats, file_path, da_date, site, engine)
+        print(f"{'single pass (' + engine + ')':<28} {elapsed:8.3f}s  {rows} rows  {baseline / elapsed:5.2f}x")
+    for max_workers in range(2, min(os.cpu_count() or 1, len(func_2_run)) + 1):
+        elapsed, rows = best_of(process_pool, repeats, file_path, da_date, site, max_workers)
+        print(f"{'process pool (' + str(max_workers) + ' workers)':<28} {elapsed:8.3f}s  {rows} rows  {baseline / elapsed:5.2f}x")
+
+if __name__ == "__main__":
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 3)
@@ -0,0 +1,200 @@
+"""
+In-process stand-ins for GCS and BigQuery, so run() can be exercised end to end without credentials.
+
+Objects live in memory. gs:// paths opened through fsspec (the parquet archives) go to the same
+in-memory store, and load jobs serialise their DataFrame to parquet the way the real client does.
+"""
+import base64
+import hashlib
+import io
+import sys
+from contextlib import contextmanager
+from unittest import mock
+
+import fsspec
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fsspec.implementations.memory import MemoryFileSystem
+from fsspec.registry import _registry
+
+class FakeGCSFileSystem(MemoryFileSystem):
+    """
+    fsspec memory filesystem answering for gs:// paths. All instances share one store.
+    """
+    protocol = ('gs', 'gcs')
+
+    @classmethod
+    def _strip_protocol(cls, path):
+        path = str(path)
+        for prefix in ('gs://', 'gcs://'):
+            if path.startswith(prefix):
+                path = path[len(prefix):]
+        return super()._strip_protocol(path)
+
+class FakeBlob:
+    def __init__(self, bucket, name: str):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def _path(self) -> str:
+        return f"gs://{self.bucket.name}/{self.name}"
+
+    @property
+    def md5_hash(self) -> str:
+        return base64.b64encode(hashlib.md5(self.download_as_bytes()).digest()).decode()
+
+    def exists(self) -> bool:
+        return FakeGCSFileSystem().exists(self._path)
+
+    def download_as_bytes(self) -> bytes:
+        return FakeGCSFileSystem().cat_file(self._path)
+
+    def upload_from_string(self, data) -> None:
+        if isinstance(data, str):
+            data = data.encode()
+        FakeGCSFileSystem().pipe_file(self._path, data)
+
+    def upload_from_filename(self, filename: str) -> None:
+        with open(filename, 'rb') as f:
+            self.upload_from_string(f.read())
+
+class FakeBucket:
+    def __init__(self, name: str):
+        self.name = name
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def get_blob(self, name: str) -> FakeBlob:
+        blob = self.blob(name)
+        return blob if blob.exists() else None
+
+    def copy_blob(self, blob: FakeBlob, destination_bucket, new_name: str) -> FakeBlob:
+        copy = destination_bucket.blob(new_name)
+        copy.upload_from_string(blob.download_as_bytes())
+        return copy
+
+class FakeStorageClient:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def bucket(self, name: str) -> FakeBucket:
+        return FakeBucket(name)
+
+    def get_bucket(self, name: str) -> FakeBucket:
+        return FakeBucket(name)
+
+class FakeLoadJob:
+    def __init__(self, destination: str, output_rows: int, input_file_bytes: int):
+        self.destination = destination
+        self.output_rows = output_rows
+        self.input_file_bytes = input_file_bytes
+
+    def result(self, timeout: float = None):
+        return self
+
+class FakeQueryJob:
+    def __init__(self, num_dml_affected_rows: int = None):
+        self.num_dml_affected_rows = num_dml_affected_rows
+
+    def result(self, timeout: float = None):
+        return []
+
+class FakeBigQueryClient:
+    """
+    records every load instead of sending it. Loaded arrow tables are kept in FakeBigQueryClient.tables,
+    created table definitions in FakeBigQueryClient.definitions. Of queries only the slice DELETEs of
+    bq_loader.delete_slices are applied, the rest return no rows.
+    """
+    tables = {}
+    definitions = {}
+    project = 'fake-project'
+
+    def __init__(self, project: str = None, *args, **kwargs):
+        if project:
+            self.project = project
+
+    def _append(self, destination: str, table: pa.Table) -> None:
+        self.tables.setdefault(str(destination), []).append(table)
+
+    def create_table(self, table, exists_ok: bool = False):
+        table_id = str(table.reference)
+        if table_id in self.definitions and not exists_ok:
+            raise ValueError(f"{table_id} already exists")
+        return self.definitions.setdefault(table_id, table)
+
+    def query(self, query: str, job_config=None):
+        if not query.startswith('DELETE FROM'):
+            return FakeQueryJob()
+        destination = query.split('`')[1]
+        values = {parameter.name: parameter.value for parameter in job_config.query_parameters}
+        slices = {(values[f'date_{i}'], values[f'site_{i}']) for i in range(len(values) // 2)}
+        deleted = 0
+        kept = []
+        for table in self.tables.get(destination, []):
+            keep = [(filename_date, filename_site) not in slices for filename_date, filename_site in
+                    zip(table.column('filename_date').to_pylist(), table.column('filename_site').to_pylist())]
+            deleted += keep.count(False)
+            kept.append(table.filter(pa.array(keep)))
+        self.tables[destination] = kept
+        return FakeQueryJob(deleted)
+
+    def load_table_from_dataframe(self, df, destination, job_config=None):
+        # the real client serialises to parquet before uploading, keep that cost in the measurement
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), buffer)
+        buffer.seek(0)
+        self._append(destination, pq.read_table(buffer))
+        return FakeLoadJob(destination, len(df), buffer.getbuffer().nbytes)
+
+    def load_table_from_file(self, file_obj, destination, job_config=None):
+        data = file_obj.read()
+        table = pq.read_table(io.BytesIO(data))
+        self._append(destination, table)
+        return FakeLoadJob(destination, table.num_rows, len(data))
+
+    def load_table_from_uri(self, source_uris, destination, job_config=None):
+        if isinstance(source_uris, str):
+            source_uris = [source_uris]
+        rows = 0
+        size = 0
+        for source_uri in source_uris:
+            with fsspec.open(source_uri, 'rb') as f:
+                data = f.read()
+            table = pq.read_table(io.BytesIO(data))
+            self._append(destination, table)
+            rows += table.num_rows
+            size += len(data)
+        return FakeLoadJob(destination, rows, size)
+
+@contextmanager
+def fake_cloud(main_module):
+    """
+    patch the storage and bigquery clients main_module creates, and gs:// in fsspec, with the in-memory fakes.
+
+    Args:
+        main_module (module): the imported main.py.
+    """
+    original = fsspec.registry.get('gs')
+    fsspec.register_implementation('gs', FakeGCSFileSystem, clobber=True)
+    # main keeps its clients across invocations and bq_loader the tables it created, start and finish without any
+    main_module._clients.clear()
+    if 'bq_loader' in sys.modules:
+        sys.modules['bq_loader']._ready_tables.clear()
+    try:
+        with mock.patch('google.cloud.storage.Client', FakeStorageClient), \
+                mock.patch('google.cloud.bigquery.Client', FakeBigQueryClient):
+            yield
+    finally:
+        main_module._clients.clear()
+        if 'bq_loader' in sys.modules:
+            sys.modules['bq_loader']._ready_tables.clear()
+        FakeBigQueryClient.tables = {}
+        FakeBigQueryClient.definitions = {}
+        FakeGCSFileSystem.store.clear()
+        FakeGCSFileSystem.pseudo_dirs[:] = ['']
+        if original is not None:
+            fsspec.register_implementation('gs', original, clobber=True)
+        else:
+            _registry.pop('gs', None)
@@ -0,0 +1,112 @@
+"""
+Build synthetic "<Site> Service Level Report - DDMMYYYY.xlsx" workbooks with all five sheets,
+laid out on the exact column ranges the loaders read, so parsers and loaders can be measured
+without a real (sensitive) Hilton file.
+
+usage: python benchmarks/synthetic_workbook.py [--rows 100000] [--reference-rows 2000] [--site Heathwood] [--date 16032022] [--out .]
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openpyxl import Workbook
+from openpyxl.utils import range_boundaries
+from schemas import TABLES
+
+#### Declare constants
+# sheets that grow with the report, the others are reference data
+LARGE_TABLES = ['hilton_servicelevel', 'hilton_forecast']
+
+# small fixed vocabularies for the low-cardinality columns
+VOCABULARIES = {
+    'STATE': ['VIC', 'NSW', 'QLD', 'WA', 'SA', 'TAS', 'NT', 'ACT'],
+    'PRODUCT_SOURCE': ['HILTON', 'THIRD PARTY', 'IMPORT'],
+    'REASON_CODE': ['01', '02', '05', '07', '11', '14', '21'],
+    'REASON_DESCRIPTION': ['Short supply', 'Quality hold', 'Late truck', 'Forecast error', 'Line breakdown'],
+    'SERVICE_GROUP': ['Beef', 'Lamb', 'Pork', 'Poultry', 'Smallgoods', 'Value Add'],
+    'VALUE_ADD_FLAG': ['Y', 'N'],
+    'DC_FLAG': ['DC', 'DSD'],
+    'PLNT': ['1010', '1020', '1030'],
+    'PLANT': ['1010', '1020', '1030'],
+    'PLANT_MATERIAL_STATUS': ['01', '02', 'Z1'],
+    'DEPT': ['MEAT', 'DELI'],
+    'SPECIES': ['BEEF', 'LAMB', 'PORK', 'CHICKEN'],
+}
+
+# sheet rows missing their required column, to exercise the notna() filter
+MISSING_REQUIRED_RATE = 0.01
+
+def report_filename(site: str, report_date: datetime) -> str:
+    return f"{site} Service Level Report - {report_date.strftime('%d%m%Y')}.xlsx"
+
+def _value(rng: random.Random, col: str, col_type: str, report_date: datetime):
+    if col in VOCABULARIES:
+        return rng.choice(VOCABULARIES[col])
+    if col_type == 'category':
+        return f"{col[:4]}{rng.randint(1, 12)}"
+    if col_type == 'float':
+        return round(rng.uniform(0, 500), 2)
+    if col_type == 'datetime':
+        return report_date - timedelta(days=rng.randint(0, 35))
+    # free text: codes and descriptions with realistic cardinality
+    if 'DESCRIPTION' in col or col in ('NAME', 'COMMENTS'):
+        return f"{col.title()} {rng.randint(1, 5000)}"
+    return str(rng.randint(100000, 999999))
+
+def write_sheet(wb: Workbook, tbl_name: str, rows: int, rng: random.Random, report_date: datetime) -> None:
+    spec = TABLES[tbl_name]
+    min_col, _, max_col, _ = range_boundaries(spec['usecols'])
+    columns = spec['columns']
+    assert max_col - min_col + 1 == len(columns), tbl_name
+
+    ws = wb.create_sheet(spec['sheet_name'])
+    # pad to the first column the loader reads, e.g. Master Data starts at D
+    padding = [f"FILLER_{i}" for i in range(1, min_col)]
+    ws.append(padding + [col for col, col_type in columns])
+    for _ in range(rows):
+        values = [_value(rng, col, col_type, report_date) for col, col_type in columns]
+        if spec['required'] is not None and rng.random() < MISSING_REQUIRED_RATE:
+            values[[col for col, col_type in columns].index(spec['required'])] = None
+        ws.append([None] * len(padding) + values)
+
+def generate_workbook(out_dir: str = '.', site: str = 'Heathwood', report_date: datetime = None,
+                      rows: int = 100000, reference_rows: int = 2000, seed: int = 0) -> str:
+    """
+    write a synthetic Service Level Report workbook.
+
+    Args:
+        out_dir (str, optional): directory to write into. Defaults to '.'.
+        site (str, optional): site name used in the filename. Defaults to 'Heathwood'.
+        report_date (datetime, optional): report date used in the filename. Defaults to today.
+        rows (int, optional): rows in Service Level Data and Forecast Data. Defaults to 100000.
+        reference_rows (int, optional): rows in Master Data, Service Group and Customer Master. Defaults to 2000.
+        seed (int, optional): random seed, the same seed gives the same values. Defaults to 0.
+
+    Returns:
+        str: path of the workbook.
+    """
+    report_date = report_date or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    rng = random.Random(seed)
+    wb = Workbook(write_only=True)
+    for tbl_name in TABLES:
+        write_sheet(wb, tbl_name, rows if tbl_name in LARGE_TABLES else reference_rows, rng, report_date)
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, report_filename(site, report_date))
+    wb.save(path)
+    return path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--reference-rows', type=int, default=2000)
+    parser.add_argument('--site', default='Heathwood')
+    parser.add_argument('--date', default=None, help='DDMMYYYY, defaults to today')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='.')
+    args = parser.parse_args()
+    report_date = datetime.strptime(args.date, '%d%m%Y') if args.date else None
+    print(generate_workbook(args.out, args.site, report_date, args.rows, args.reference_rows, args.seed))
@@ -0,0 +1,220 @@
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow.parquet as pq
+from google.cloud import bigquery
+from instrumentation import log
+
+#### Declare constants
+# total seconds to wait for every submitted load job, keep under the function timeout.
+LOAD_TIMEOUT = float(os.environ.get('HILTON_LOAD_TIMEOUT', '480'))
+
+# "0" appends reloaded reports, otherwise a load first deletes the (filename_date, filename_site) slices it carries.
+REPLACE_SLICES = os.environ.get('HILTON_REPLACE_SLICES', '1') != '0'
+# site infer_site gives every unrecognised filename. Reports of different unknown sites share it, so its slices are never replaced.
+UNKNOWN_SITE = 'Other'
+
+# tables created or checked by ensure_table in this process
+_ready_tables = set()
+
+def ensure_table(client: bigquery.Client, table: bigquery.Table) -> None:
+    """
+    create a destination table, with its partitioning and clustering, once per process.
+
+    An existing table is left as it is. One created before partitioning was introduced is
+    logged, since BigQuery cannot partition a table in place; recreate it with
+    CREATE TABLE ... PARTITION BY ... CLUSTER BY ... AS SELECT to get the pruning.
+
+    Args:
+        client (bigquery.Client): client to create the table with.
+        table (bigquery.Table): definition, e.g. from schemas.bigquery_table.
+    """
+    table_id = str(table.reference)
+    if table_id in _ready_tables:
+        return
+    existing = client.create_table(table, exists_ok=True)
+    if table.time_partitioning is not None and existing.time_partitioning is None:
+        log(f"{existing.table_id} is not partitioned, every query scans all of it", severity='WARNING', table=existing.table_id)
+    _ready_tables.add(table_id)
+
+def replaceable_slices(slices: list) -> list:
+    """
+    the (filename_date, filename_site) slices a load may delete: none with HILTON_REPLACE_SLICES=0,
+    and never those of UNKNOWN_SITE, which would delete another unknown site's report of the same date.
+    """
+    if not slices or not REPLACE_SLICES:
+        return []
+    return [(filename_date, filename_site) for filename_date, filename_site in slices if filename_site != UNKNOWN_SITE]
+
+def delete_slices(client: bigquery.Client, bq_ds_tbl: str, slices: list):
+    """
+    delete the rows of the given report dates and sites, so the following load replaces them.
+
+    On a table partitioned by filename_date and clustered by filename_site this only touches
+    the slices themselves.
+
+    Args:
+        client (bigquery.Client): client to run the DML with.
+        bq_ds_tbl (str): table as dataset.table.
+        slices (list): (filename_date, filename_site) pairs.
+
+    Returns:
+        bigquery.QueryJob: the finished DELETE.
+    """
+    conditions = []
+    parameters = []
+    for i, (filename_date, filename_site) in enumerate(sorted(set(slices))):
+        conditions.append(f"(filename_date = @date_{i} AND filename_site = @site_{i})")
+        parameters.append(bigquery.ScalarQueryParameter(f'date_{i}', 'DATETIME', filename_date))
+        parameters.append(bigquery.ScalarQueryParameter(f'site_{i}', 'STRING', filename_site))
+    query = f"DELETE FROM `{bq_ds_tbl}` WHERE {' OR '.join(conditions)}"
+    job = client.query(query, job_config=bigquery.QueryJobConfig(query_parameters=parameters))
+    job.result()
+    log(f"replaced {len(conditions)} slices of {bq_ds_tbl}", table=bq_ds_tbl, slices=len(conditions), deleted_rows=job.num_dml_affected_rows)
+    return job
+
+class LoadCoordinator:
+    """
+    submit BigQuery load jobs through one shared client and wait on them together.
+
+    load_table_from_dataframe serialises and uploads before it returns, so submissions run on
+    a small thread pool and the uploads overlap. wait() then blocks on every job against one
+    total deadline and raises if any of them failed.
+
+    Every submit takes replace, the (filename_date, filename_site) slices the rows belong to.
+    Those slices are deleted on the same thread right before the load starts, except those of
+    UNKNOWN_SITE, whose rows are appended.
+
+    With a mirror (HILTON_MIRROR_DIR by default) every job that succeeds is also appended to that
+    local copy in wait(), replacing the same slices. on_done(stats) is then called for it, before
+    wait() moves on to the next job.
+    """
+
+    def __init__(self, client: bigquery.Client, max_workers: int = 5, mirror=None, on_done=None):
+        from mirror import MirrorClient, get_mirror
+        self.client = client
+        self.max_workers = max_workers
+        self.on_done = on_done
+        # a client that already loads into the mirror is not mirrored twice
+        self.mirror = None if isinstance(client, MirrorClient) else (mirror or get_mirror())
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._pending = []
+        self.report = []
+
+    def submit(self, df, bq_ds_tbl: str, job_config: bigquery.LoadJobConfig = None, replace: list = None) -> None:
+        """
+        start loading df into bq_ds_tbl without waiting for it.
+
+        Args:
+            df (pd.DataFrame): rows to load.
+            bq_ds_tbl (str): destination as dataset.table.
+            job_config (bigquery.LoadJobConfig, optional): Defaults to WRITE_APPEND.
+            replace (list, optional): (filename_date, filename_site) slices to delete first. Defaults to None.
+        """
+        if job_config is None:
+            job_config = bigquery.LoadJobConfig(write_disposition="WRITE_APPEND")
+        log(f"writing {bq_ds_tbl}", table=bq_ds_tbl, rows=len(df))
+        future = self._pool.submit(self._replace_and_load, replace, self.client.load_table_from_dataframe, df, bq_ds_tbl, job_config=job_config)
+        self._pending.append((bq_ds_tbl, time.monotonic(), future, df, replace))
+
+    def submit_uri(self, source_uri: str, bq_ds_tbl: str, job_config: bigquery.LoadJobConfig = None, replace: list = None) -> None:
+        """
+        start loading a parquet file already in GCS into bq_ds_tbl without waiting for it.
+
+        Args:
+            source_uri (str or list): gs:// path of the parquet file, or a list of them for one job.
+            bq_ds_tbl (str): destination as dataset.table.
+            job_config (bigquery.LoadJobConfig, optional): Defaults to WRITE_APPEND.
+            replace (list, optional): (filename_date, filename_site) slices to delete first. Defaults to None.
+        """
+        if job_config is None:
+            job_config = bigquery.LoadJobConfig(write_disposition="WRITE_APPEND")
+        job_config.source_format = bigquery.SourceFormat.PARQUET
+        log(f"writing {bq_ds_tbl} from {source_uri}", table=bq_ds_tbl, source_uri=source_uri)
+        future = self._pool.submit(self._replace_and_load, replace, self.client.load_table_from_uri, source_uri, bq_ds_tbl, job_config=job_config)
+        self._pending.append((bq_ds_tbl, time.monotonic(), future, source_uri, replace))
+
+    def submit_arrow(self, table, bq_ds_tbl: str, job_config: bigquery.LoadJobConfig = None, replace: list = None) -> None:
+        """
+        start loading an arrow table as a single parquet upload without waiting for it.
+
+        Args:
+            table (pa.Table): rows to load, e.g. many files' rows concatenated.
+            bq_ds_tbl (str): destination as dataset.table.
+            job_config (bigquery.LoadJobConfig, optional): Defaults to WRITE_APPEND.
+            replace (list, optional): (filename_date, filename_site) slices to delete first. Defaults to None.
+        """
+        if job_config is None:
+            job_config = bigquery.LoadJobConfig(write_disposition="WRITE_APPEND")
+        job_config.source_format = bigquery.SourceFormat.PARQUET
+        log(f"writing {bq_ds_tbl}", table=bq_ds_tbl, rows=table.num_rows)
+        future = self._pool.submit(self._replace_and_load, replace, self._load_arrow, table, bq_ds_tbl, job_config)
+        self._pending.append((bq_ds_tbl, time.monotonic(), future, table, replace))
+
+    def _replace_and_load(self, replace: list, load, source, bq_ds_tbl: str, *args, **kwargs):
+        replace = replaceable_slices(replace)
+        if replace:
+            delete_slices(self.client, bq_ds_tbl, replace)
+        return load(source, bq_ds_tbl, *args, **kwargs)
+
+    def _load_arrow(self, table, bq_ds_tbl: str, job_config: bigquery.LoadJobConfig):
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer)
+        buffer.seek(0)
+        return self.client.load_table_from_file(buffer, bq_ds_tbl, job_config=job_config)
+
+    def _mirror(self, source, bq_ds_tbl: str, replace: list) -> None:
+        # the mirror is a convenience copy, failing to write it never fails the BigQuery load
+        try:
+            replace = replaceable_slices(replace)
+            if replace:
+                self.mirror.delete_slices(bq_ds_tbl, replace)
+            self.mirror.append(bq_ds_tbl, source)
+        except Exception as e:
+            log(f"could not mirror {bq_ds_tbl}", severity='WARNING', table=bq_ds_tbl, mirror=self.mirror.directory, error=f"{type(e).__name__}: {e}")
+
+    def wait(self, timeout: float = None) -> list:
+        """
+        wait for every submitted job to finish within one total deadline.
+
+        Args:
+            timeout (float, optional): total seconds for all jobs. Defaults to LOAD_TIMEOUT.
+
+        Raises:
+            RuntimeError: if any job failed or did not finish before the deadline.
+
+        Returns:
+            list: one dict per job with table, rows, bytes, seconds and error.
+        """
+        deadline = time.monotonic() + (LOAD_TIMEOUT if timeout is None else timeout)
+        report = []
+        for bq_ds_tbl, submitted, future, source, replace in self._pending:
+            stats = {'table': bq_ds_tbl, 'rows': None, 'bytes': None, 'seconds': None, 'error': None}
+            try:
+                job = future.result(timeout=max(0, deadline - time.monotonic()))
+                job.result(timeout=max(0, deadline - time.monotonic()))
+                stats['rows'] = job.output_rows
+                stats['bytes'] = job.input_file_bytes
+            except Exception as e:
+                stats['error'] = f"{type(e).__name__}: {e}"
+            if self.mirror is not None and stats['error'] is None:
+                self._mirror(source, bq_ds_tbl, replace)
+            stats['seconds'] = round(time.monotonic() - submitted, 3)
+            log(f"loaded {bq_ds_tbl}", severity='ERROR' if stats['error'] else 'INFO', stage='bigquery_load', **stats)
+            if self.on_done is not None and stats['error'] is None:
+                try:
+                    self.on_done(stats)
+                except Exception as e:
+                    log(f"on_done failed for {bq_ds_tbl}", severity='WARNING', table=bq_ds_tbl, error=f"{type(e).__name__}: {e}")
+            report.append(stats)
+        self._pending = []
+        self._pool.shutdown(wait=False)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        # kept for callers that need to know which jobs succeeded when this raises
+        self.report = report
+
+        failed = [stats['table'] for stats in report if stats['error'] is not None]
+        if failed:
+            raise RuntimeError(f"BigQuery load failed for {', '.join(failed)}")
+        return report
@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+import fsspec
+
+#### Declare constants
+# where checkpoints of unfinished files live, defaults to <bucket>_output/checkpoints. "none" switches them off.
+CHECKPOINT_DIR = os.environ.get('HILTON_CHECKPOINT_DIR', '')
+
+class Checkpoint:
+    """
+    progress of one file through run(), keyed by file_contents_md5 and table name, so a retry after a
+    failure only redoes what did not finish.
+
+    For every table it keeps the parquet archive written (the parsed arrow intermediate, already in the
+    _output bucket) and whether its load succeeded. It also keeps whether the raw file was copied, and
+    which sheets were skipped as unchanged with their fingerprints. The state is one small JSON file,
+    deleted once the file is fully ingested.
+
+    mark() saves as each archive and load finishes, from their threads, so a run killed by its timeout
+    keeps what it finished.
+    """
+
+    def __init__(self, directory: str, file_contents_md5: str):
+        self.path = f"{directory.rstrip('/')}/{file_contents_md5}.json"
+        fs, path = fsspec.core.url_to_fs(self.path)
+        if fs.exists(path):
+            with fs.open(path, 'r') as f:
+                self.state = json.load(f)
+        else:
+            self.state = {}
+        self.state.setdefault('tables', {})
+        self._lock = threading.RLock()
+
+    @property
+    def resumed(self) -> bool:
+        # anything recorded means an earlier attempt got at least as far as copying the file
+        return bool(self.state.get('copied'))
+
+    def table(self, tbl_name: str) -> dict:
+        with self._lock:
+            return self.state['tables'].setdefault(tbl_name, {'archive': None, 'loaded': False})
+
+    def mark(self, tbl_name: str, **fields) -> None:
+        """
+        record archive=path or loaded=True for a table and save straight away.
+        """
+        with self._lock:
+            self.table(tbl_name).update(fields)
+            self.save()
+
+    def archive(self, tbl_name: str) -> str:
+        """
+        path of the table's archive when an earlier attempt wrote it, else None.
+        """
+        return self.table(tbl_name)['archive']
+
+    def loaded(self, tbl_name: str) -> bool:
+        return self.table(tbl_name)['loaded']
+
+    def done(self, tbl_name: str) -> bool:
+        return self.archive(tbl_name) is not None and self.loaded(tbl_name)
+
+    def save(self) -> None:
+        fs, path = fsspec.core.url_to_fs(self.path)
+        with self._lock:
+            fs.makedirs(path.rsplit('/', 1)[0], exist_ok=True)
+            with fs.open(path, 'w') as f:
+                json.dump(self.state, f)
+
+    def clear(self) -> None:
+        fs, path = fsspec.core.url_to_fs(self.path)
+        if fs.exists(path):
+            fs.rm(path)
+
+class NoCheckpoint(Checkpoint):
+    """
+    stand-in when HILTON_CHECKPOINT_DIR is "none": starts empty every time and never writes.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.state = {'tables': {}}
+        self._lock = threading.RLock()
+
+    def save(self) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+def get_checkpoint(directory: str, file_contents_md5: str) -> Checkpoint:
+    """
+    checkpoint of a file, in HILTON_CHECKPOINT_DIR or else directory.
+    """
+    if CHECKPOINT_DIR == 'none':
+        return NoCheckpoint()
+    return Checkpoint(CHECKPOINT_DIR or directory, file_contents_md5)
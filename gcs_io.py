@@ -0,0 +1,62 @@
+import base64
+import hashlib
+import io
+
+#### Declare constants
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def download_to_buffer(blob) -> io.BytesIO:
+    """
+    download a blob once into memory instead of to /tmp (tmpfs, which also counts against memory).
+
+    Args:
+        blob (storage.Blob): blob to download.
+
+    Returns:
+        io.BytesIO: buffer sharing the downloaded bytes, positioned at the start.
+    """
+    return io.BytesIO(blob.download_as_bytes())
+
+def blob_md5_hexdigest(blob) -> str:
+    """
+    md5 of the blob contents taken from its GCS metadata, so nothing is read.
+
+    Args:
+        blob (storage.Blob): blob fetched with bucket.get_blob, so its metadata is loaded.
+
+    Returns:
+        str: hex md5 (same format as hashlib's hexdigest), or None for composite objects without one.
+    """
+    if not blob.md5_hash:
+        return None
+    return base64.b64decode(blob.md5_hash).hex()
+
+def buffer_md5_hexdigest(buffer: io.BytesIO) -> str:
+    """
+    md5 of an in-memory buffer without copying it.
+
+    Args:
+        buffer (io.BytesIO): buffer to hash.
+
+    Returns:
+        str: hex md5.
+    """
+    with buffer.getbuffer() as view:
+        return hashlib.md5(view).hexdigest()
+
+def file_md5_hexdigest(file_path: str, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """
+    md5 of a local file, read in chunks and closed afterwards.
+
+    Args:
+        file_path (str): path to the file.
+        chunk_size (int, optional): bytes per read. Defaults to HASH_CHUNK_SIZE.
+
+    Returns:
+        str: hex md5.
+    """
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
@@ -0,0 +1,86 @@
+import os
+import numpy as np
+import pandas as pd
+
+#### Declare constants
+# "1" also loads Forecast Data unpivoted to one row per material, forecast date and horizon.
+HORIZONS_ENABLED = os.environ.get('HILTON_FORECAST_HORIZONS', '') == '1'
+HORIZON_TABLE = 'hilton_forecast_horizons'
+
+# (weeks before the forecast date, forecast column, TPRP column) of hilton_forecast
+HORIZONS = [
+    (1, '_1_WEEK_OLD_FORECAST', '_1_WEEK_OLD_TPRP'),
+    (2, '_2_WEEKS_OLD_FORECAST', '_2_WEEKS_OLD_TPRP'),
+    (3, '_3_WEEKS_OLD_FORECAST', '_3_WEEKS_OLD_TPRP'),
+    (4, '_4_WEEKS_OLD_FORECAST', '_4_WEEKS_OLD_TPRP'),
+    (5, '_5_WEEKS_OLD_FORECAST', '_5_WEEKS_OLD_TPRP'),
+]
+
+# repeated once per horizon
+KEY_COLUMNS = [
+    ('filename_date', 'datetime'),
+    ('filename_site', 'category'),
+    ('MATERIAL_NUMBER', 'category'),
+    ('PLANT', 'category'),
+    ('PRODUCT_SOURCE', 'category'),
+    ('DATE', 'datetime'),
+    ('upload_utc_dt', 'timestamp'),
+    ('file_contents_md5', 'category'),
+]
+
+HORIZON_COLUMNS = KEY_COLUMNS + [
+    ('HORIZON_WEEKS', 'int'),
+    ('FORECAST', 'float'),
+    ('TPRP', 'float'),
+]
+
+def _repeat(series: pd.Series, col_type: str, n: int):
+    # categoricals repeat their integer codes, not their strings
+    if col_type == 'category':
+        categorical = pd.Categorical(series)
+        return pd.Categorical.from_codes(np.repeat(categorical.codes, n), categorical.categories)
+    return np.repeat(series.to_numpy(), n)
+
+def forecast_horizons(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    unpivot the _N_WEEK(S)_OLD_FORECAST and _N_WEEK(S)_OLD_TPRP columns of hilton_forecast into one row per
+    material, date and horizon. Horizons with neither a forecast nor a TPRP are dropped.
+
+    Args:
+        df (pd.DataFrame): hilton_forecast rows, with the upload columns.
+
+    Returns:
+        pd.DataFrame: HORIZON_COLUMNS, with int8 horizons and categorical keys.
+    """
+    n = len(HORIZONS)
+    forecast = df[[forecast_col for horizon, forecast_col, tprp_col in HORIZONS]].to_numpy(dtype=np.float64).ravel()
+    tprp = df[[tprp_col for horizon, forecast_col, tprp_col in HORIZONS]].to_numpy(dtype=np.float64).ravel()
+    long = pd.DataFrame({col: _repeat(df[col], col_type, n) for col, col_type in KEY_COLUMNS})
+    long['HORIZON_WEEKS'] = np.tile(np.array([horizon for horizon, forecast_col, tprp_col in HORIZONS], dtype=np.int8), len(df))
+    long['FORECAST'] = forecast
+    long['TPRP'] = tprp
+    return long[~(np.isnan(forecast) & np.isnan(tprp))].reset_index(drop=True)
+
+class HorizonBuilder:
+    """
+    collects forecast_horizons of every hilton_forecast frame or streamed chunk, for one load.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self.sources = {'hilton_forecast'}
+
+    def add(self, tbl_name: str, df: pd.DataFrame) -> None:
+        if tbl_name == 'hilton_forecast' and len(df):
+            self._parts.append(forecast_horizons(df))
+
+    def tables(self) -> dict:
+        if not self._parts:
+            return {}
+        return {HORIZON_TABLE: pd.concat(self._parts, ignore_index=True)}
+
+    def columns(self, tbl_name: str) -> list:
+        return HORIZON_COLUMNS
+
+    def cluster(self, tbl_name: str) -> str:
+        return 'MATERIAL_NUMBER'
@@ -0,0 +1,85 @@
+import cProfile
+import functools
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+#### Declare constants
+# set to trace python allocations per stage (slower), otherwise only peak RSS is reported.
+TRACEMALLOC = os.environ.get('HILTON_TRACEMALLOC', '') == '1'
+# directory to dump cProfile stats of run()/run_local() into, off when empty.
+PROFILE_DIR = os.environ.get('HILTON_PROFILE_DIR', '')
+
+def log(message: str, severity: str = 'INFO', **fields) -> None:
+    """
+    print one JSON log line. Cloud Logging parses these into jsonPayload, using severity and message.
+
+    Args:
+        message (str): human readable message.
+        severity (str, optional): Cloud Logging severity. Defaults to 'INFO'.
+        **fields: extra structured fields.
+    """
+    entry = {'severity': severity, 'message': message}
+    entry.update(fields)
+    print(json.dumps(entry, default=str), file=sys.stdout, flush=True)
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+@contextmanager
+def span(stage: str, **fields):
+    """
+    time a stage and log its wall time, CPU time and memory as one JSON line.
+
+    Yields a dict; anything added to it (rows, bytes, ...) is logged with the stage.
+
+    Args:
+        stage (str): stage name, e.g. "download" or "parse".
+        **fields: extra structured fields, e.g. table=tbl_name.
+    """
+    metrics = dict(fields)
+    if TRACEMALLOC:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    severity = 'INFO'
+    try:
+        yield metrics
+    except Exception as e:
+        severity = 'ERROR'
+        metrics['error'] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        metrics['wall_seconds'] = round(time.perf_counter() - wall_start, 3)
+        metrics['cpu_seconds'] = round(time.process_time() - cpu_start, 3)
+        metrics['peak_rss_mb'] = peak_rss_mb()
+        if TRACEMALLOC:
+            metrics['peak_traced_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+        log(f"stage {stage}", severity=severity, stage=stage, **metrics)
+
+def profiled(func):
+    """
+    decorator that runs func under cProfile and dumps the stats to HILTON_PROFILE_DIR when it is set.
+    Inspect a dump with `python -m pstats <file>` or snakeviz.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not PROFILE_DIR:
+            return func(*args, **kwargs)
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{func.__name__}_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.prof")
+            profile.dump_stats(path)
+            log(f"profile written to {path}", path=path)
+    return wrapper
@@ -0,0 +1,144 @@
+import os
+import numpy as np
+import pandas as pd
+
+#### Declare constants
+# "0" switches the summary tables off.
+SUMMARIES_ENABLED = os.environ.get('HILTON_SUMMARIES', '1') != '0'
+
+# (weeks before the forecast week, column) of every forecast kept in Forecast Data, 0 being the final one
+FORECAST_HORIZONS = [
+    (0, 'FORECAST'),
+    (1, '_1_WEEK_OLD_FORECAST'),
+    (2, '_2_WEEKS_OLD_FORECAST'),
+    (3, '_3_WEEKS_OLD_FORECAST'),
+    (4, '_4_WEEKS_OLD_FORECAST'),
+    (5, '_5_WEEKS_OLD_FORECAST'),
+]
+
+def fill_rate_sums(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    order, delivered and shortage quantities of Service Level Data summed by site, service group, reason and state.
+    """
+    keys = SUMMARIES['hilton_kpi_fill_rate']['keys']
+    sums = df[keys + ['ORDER_QUANTITY', 'DELIVERED_QTY', 'SHORTAGE_QTY']].assign(LINES=1)
+    # lines without a shortage have no REASON_CODE, keep them
+    return sums.groupby(keys, observed=True, dropna=False, sort=False).sum(min_count=1).reset_index()
+
+def fill_rate(sums: pd.DataFrame) -> pd.DataFrame:
+    sums['FILL_RATE'] = sums['DELIVERED_QTY'] / sums['ORDER_QUANTITY'].where(sums['ORDER_QUANTITY'] != 0)
+    return sums
+
+def forecast_error_sums(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    forecast, actual sales and absolute error of Forecast Data summed by site, forecast week, product source and
+    plant, one row per horizon. Only rows with both a forecast and actual sales at that horizon count.
+    """
+    keys = [key for key in SUMMARIES['hilton_kpi_forecast_accuracy']['keys'] if key != 'HORIZON_WEEKS']
+    actual = df['ACTUAL_SALES'].to_numpy(dtype=np.float64)
+    horizons = []
+    for horizon, col in FORECAST_HORIZONS:
+        forecast = df[col].to_numpy(dtype=np.float64)
+        valid = ~(np.isnan(forecast) | np.isnan(actual))
+        sums = df.loc[valid, keys].assign(
+            HORIZON_WEEKS=horizon,
+            LINES=1,
+            FORECAST_QTY=forecast[valid],
+            ACTUAL_SALES=actual[valid],
+            ABS_ERROR=np.abs(forecast[valid] - actual[valid]),
+        )
+        horizons.append(sums.groupby(keys + ['HORIZON_WEEKS'], observed=True, dropna=False, sort=False).sum().reset_index())
+    return pd.concat(horizons, ignore_index=True)
+
+def forecast_accuracy(sums: pd.DataFrame) -> pd.DataFrame:
+    actual = sums['ACTUAL_SALES'].where(sums['ACTUAL_SALES'] != 0)
+    # 1 - weighted absolute percentage error, and bias as a share of actual sales
+    sums['ACCURACY'] = 1 - sums['ABS_ERROR'] / actual
+    sums['BIAS'] = (sums['FORECAST_QTY'] - sums['ACTUAL_SALES']) / actual
+    return sums
+
+# summary tables computed from the hilton_* tables at ingest. Sums are additive, so chunks and files
+# are summed separately and combined; the ratios are only taken once everything is summed.
+SUMMARIES = {
+    'hilton_kpi_fill_rate': {
+        'source': 'hilton_servicelevel',
+        'keys': ['filename_date', 'filename_site', 'SERVICE_GROUP', 'REASON_CODE', 'STATE'],
+        'sums': fill_rate_sums,
+        'ratios': fill_rate,
+        'columns': [
+            ('filename_date', 'datetime'),
+            ('filename_site', 'category'),
+            ('SERVICE_GROUP', 'category'),
+            ('REASON_CODE', 'category'),
+            ('STATE', 'category'),
+            ('LINES', 'int'),
+            ('ORDER_QUANTITY', 'float'),
+            ('DELIVERED_QTY', 'float'),
+            ('SHORTAGE_QTY', 'float'),
+            ('FILL_RATE', 'float'),
+        ],
+        'cluster': 'SERVICE_GROUP',
+    },
+    'hilton_kpi_forecast_accuracy': {
+        'source': 'hilton_forecast',
+        'keys': ['filename_date', 'filename_site', 'DATE', 'PRODUCT_SOURCE', 'PLANT', 'HORIZON_WEEKS'],
+        'sums': forecast_error_sums,
+        'ratios': forecast_accuracy,
+        'columns': [
+            ('filename_date', 'datetime'),
+            ('filename_site', 'category'),
+            ('DATE', 'datetime'),
+            ('PRODUCT_SOURCE', 'category'),
+            ('PLANT', 'category'),
+            ('HORIZON_WEEKS', 'int'),
+            ('LINES', 'int'),
+            ('FORECAST_QTY', 'float'),
+            ('ACTUAL_SALES', 'float'),
+            ('ABS_ERROR', 'float'),
+            ('ACCURACY', 'float'),
+            ('BIAS', 'float'),
+        ],
+        'cluster': 'PLANT',
+    },
+}
+
+class SummaryBuilder:
+    """
+    collects the sums of every summary table from whole tables or streamed chunks, across one or many files.
+
+    add() is called with each hilton_* frame as it is read, tables() then combines the sums and takes the ratios.
+    Like horizons.HorizonBuilder, columns() and cluster() describe each output table for main.submit_derived.
+    """
+
+    def __init__(self):
+        self._sums = {summary_name: [] for summary_name in SUMMARIES}
+        # hilton_* tables add() reads from
+        self.sources = {spec['source'] for spec in SUMMARIES.values()}
+
+    def add(self, tbl_name: str, df: pd.DataFrame) -> None:
+        for summary_name, spec in SUMMARIES.items():
+            if spec['source'] == tbl_name and len(df):
+                self._sums[summary_name].append(spec['sums'](df))
+
+    def tables(self) -> dict:
+        """
+        Returns:
+            dict: {summary_name: pd.DataFrame} for every summary that received rows.
+        """
+        tables = {}
+        for summary_name, parts in self._sums.items():
+            if not parts:
+                continue
+            spec = SUMMARIES[summary_name]
+            sums = pd.concat(parts, ignore_index=True)
+            if len(parts) > 1:
+                sums = sums.groupby(spec['keys'], observed=True, dropna=False, sort=False).sum(min_count=1).reset_index()
+            df = spec['ratios'](sums)[[col for col, col_type in spec['columns']]]
+            tables[summary_name] = df.astype({col: 'int64' for col, col_type in spec['columns'] if col_type == 'int'})
+        return tables
+
+    def columns(self, summary_name: str) -> list:
+        return SUMMARIES[summary_name]['columns']
+
+    def cluster(self, summary_name: str) -> str:
+        return SUMMARIES[summary_name]['cluster']
@@ -0,0 +1,176 @@
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+#### Declare constants
+# "bigquery" (default), "none", or a path to a local sqlite file.
+LEDGER_BACKEND = os.environ.get('HILTON_LEDGER', 'bigquery')
+LEDGER_TABLE = 'hilton.ingested_files'
+# fingerprint of every sheet loaded, see workbook.sheet_fingerprints
+SHEETS_TABLE = 'hilton.ingested_sheets'
+
+class SqliteLedger:
+    """
+    file_contents_md5 ledger kept in a local sqlite file. Stand-in for BigQueryLedger in tests and local runs.
+    """
+
+    def __init__(self, path: str = ':memory:'):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS ingested_files ("
+            "file_contents_md5 TEXT PRIMARY KEY, filename_site TEXT, filename_date TEXT, filename TEXT, upload_utc_dt TEXT)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS ingested_sheets ("
+            "filename_site TEXT, sheet_name TEXT, fingerprint TEXT, filename TEXT, upload_utc_dt TEXT)"
+        )
+
+    def seen(self, file_contents_md5: str) -> bool:
+        row = self.conn.execute("SELECT 1 FROM ingested_files WHERE file_contents_md5 = ?", (file_contents_md5,)).fetchone()
+        return row is not None
+
+    def record(self, file_contents_md5: str, site: str, da_date: datetime, filename: str) -> None:
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO ingested_files VALUES (?, ?, ?, ?, ?)",
+                (file_contents_md5, site, da_date.strftime("%Y-%m-%d"), filename, datetime.now(timezone.utc).isoformat()),
+            )
+
+    def last_sheet_fingerprints(self, site: str) -> dict:
+        rows = self.conn.execute(
+            "SELECT sheet_name, fingerprint FROM ingested_sheets WHERE filename_site = ? ORDER BY upload_utc_dt", (site,)
+        ).fetchall()
+        # later rows win
+        return dict(rows)
+
+    def record_sheets(self, site: str, filename: str, fingerprints: dict) -> None:
+        upload_utc_dt = datetime.now(timezone.utc).isoformat()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO ingested_sheets VALUES (?, ?, ?, ?, ?)",
+                [(site, sheet_name, fingerprint, filename, upload_utc_dt) for sheet_name, fingerprint in fingerprints.items()],
+            )
+
+class BigQueryLedger:
+    """
+    file_contents_md5 ledger kept in a small BigQuery table next to the hilton_* tables.
+    """
+
+    def __init__(self, client, table: str = LEDGER_TABLE, sheets_table: str = SHEETS_TABLE):
+        from google.cloud import bigquery
+        self.client = client
+        self.table = table
+        self.sheets_table = sheets_table
+        schema = [
+            bigquery.SchemaField('file_contents_md5', 'STRING', mode='REQUIRED'),
+            bigquery.SchemaField('filename_site', 'STRING'),
+            bigquery.SchemaField('filename_date', 'DATE'),
+            bigquery.SchemaField('filename', 'STRING'),
+            bigquery.SchemaField('upload_utc_dt', 'TIMESTAMP'),
+        ]
+        self.client.create_table(bigquery.Table(f"{client.project}.{table}", schema=schema), exists_ok=True)
+        sheets_schema = [
+            bigquery.SchemaField('filename_site', 'STRING', mode='REQUIRED'),
+            bigquery.SchemaField('sheet_name', 'STRING', mode='REQUIRED'),
+            bigquery.SchemaField('fingerprint', 'STRING', mode='REQUIRED'),
+            bigquery.SchemaField('filename', 'STRING'),
+            bigquery.SchemaField('upload_utc_dt', 'TIMESTAMP'),
+        ]
+        self.client.create_table(bigquery.Table(f"{client.project}.{sheets_table}", schema=sheets_schema), exists_ok=True)
+
+    def seen(self, file_contents_md5: str) -> bool:
+        from google.cloud import bigquery
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ScalarQueryParameter('md5', 'STRING', file_contents_md5)]
+        )
+        query = f"SELECT 1 FROM `{self.table}` WHERE file_contents_md5 = @md5 LIMIT 1"
+        return len(list(self.client.query(query, job_config=job_config).result())) > 0
+
+    def record(self, file_contents_md5: str, site: str, da_date: datetime, filename: str) -> None:
+        row = {
+            'file_contents_md5': file_contents_md5,
+            'filename_site': site,
+            'filename_date': da_date.strftime("%Y-%m-%d"),
+            'filename': filename,
+            'upload_utc_dt': datetime.now(timezone.utc).isoformat(),
+        }
+        errors = self.client.insert_rows_json(self.table, [row])
+        if errors:
+            raise RuntimeError(f"could not record {file_contents_md5} in {self.table}: {errors}")
+
+    def last_sheet_fingerprints(self, site: str) -> dict:
+        from google.cloud import bigquery
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ScalarQueryParameter('site', 'STRING', site)]
+        )
+        query = (
+            f"SELECT sheet_name, fingerprint FROM `{self.sheets_table}` WHERE filename_site = @site "
+            "QUALIFY ROW_NUMBER() OVER (PARTITION BY sheet_name ORDER BY upload_utc_dt DESC) = 1"
+        )
+        return {row['sheet_name']: row['fingerprint'] for row in self.client.query(query, job_config=job_config).result()}
+
+    def record_sheets(self, site: str, filename: str, fingerprints: dict) -> None:
+        upload_utc_dt = datetime.now(timezone.utc).isoformat()
+        rows = [
+            {'filename_site': site, 'sheet_name': sheet_name, 'fingerprint': fingerprint, 'filename': filename, 'upload_utc_dt': upload_utc_dt}
+            for sheet_name, fingerprint in fingerprints.items()
+        ]
+        errors = self.client.insert_rows_json(self.sheets_table, rows)
+        if errors:
+            raise RuntimeError(f"could not record sheet fingerprints of {filename} in {self.sheets_table}: {errors}")
+
+class CachedLedger:
+    """
+    wraps a ledger backend with an in-process cache of md5s already known to be ingested,
+    so repeat events on a warm instance never reach the backend.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._seen = set()
+        self._fingerprints = {}
+
+    def seen(self, file_contents_md5: str) -> bool:
+        if file_contents_md5 in self._seen:
+            return True
+        if self.backend.seen(file_contents_md5):
+            self._seen.add(file_contents_md5)
+            return True
+        return False
+
+    def record(self, file_contents_md5: str, site: str, da_date: datetime, filename: str) -> None:
+        self.backend.record(file_contents_md5, site, da_date, filename)
+        self._seen.add(file_contents_md5)
+
+    def last_sheet_fingerprints(self, site: str) -> dict:
+        if site not in self._fingerprints:
+            self._fingerprints[site] = self.backend.last_sheet_fingerprints(site)
+        return self._fingerprints[site]
+
+    def record_sheets(self, site: str, filename: str, fingerprints: dict) -> None:
+        self.backend.record_sheets(site, filename, fingerprints)
+        self.last_sheet_fingerprints(site).update(fingerprints)
+
+_ledger = None
+
+def get_ledger(client=None, backend: str = None):
+    """
+    build (once per process) the ledger selected by HILTON_LEDGER.
+
+    Args:
+        client (bigquery.Client, optional): client for the bigquery backend.
+        backend (str, optional): "bigquery", "none" or a sqlite path. Defaults to LEDGER_BACKEND.
+
+    Returns:
+        CachedLedger: or None when the ledger is switched off.
+    """
+    global _ledger
+    backend = LEDGER_BACKEND if backend is None else backend
+    if backend == 'none':
+        return None
+    if _ledger is None:
+        if backend == 'bigquery':
+            _ledger = CachedLedger(BigQueryLedger(client))
+        else:
+            _ledger = CachedLedger(SqliteLedger(backend))
+    return _ledger
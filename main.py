@@ -1,18 +1,34 @@
-from google.cloud import storage
-import pandas as pd
 import re
 import json
 import re
-from google.cloud import bigquery
 from datetime import datetime,timezone  
 import os
-import hashlib
-import numpy as np
+import base64
+from gcs_io import download_to_buffer, blob_md5_hexdigest, buffer_md5_hexdigest
+from ledger import get_ledger
+from instrumentation import log, span, profiled
+# pandas, numpy, pyarrow and the google clients are imported inside the functions that need them,
+# so files rejected by is_correctFileName return without loading any of them.
     
 #### Declare constants
 PROJECT_ID = 'gcp-wow-pvc-grnstck-prod'
 
-now_utc = datetime.now(timezone.utc) # timezone aware object, unlike datetime.utcnow().
+# clients are kept across warm invocations so their HTTP connections are reused
+_clients = {}
+
+def get_storage_client():
+    from google.cloud import storage
+    if 'storage' not in _clients:
+        _clients['storage'] = storage.Client()
+    return _clients['storage']
+
+def get_bigquery_client():
+    from google.cloud import bigquery
+    from mirror import BIGQUERY_BACKEND, mirror_client
+    if 'bigquery' not in _clients:
+        # HILTON_BIGQUERY=mirror loads into the local mirror only
+        _clients['bigquery'] = mirror_client() if BIGQUERY_BACKEND == 'mirror' else bigquery.Client(project=PROJECT_ID)
+    return _clients['bigquery']
     
 def pretty_print_event(event: dict = None) -> None:
     """
@@ -21,8 +37,7 @@ def pretty_print_event(event: dict = None) -> None:
     Args:
         event (dict, optional): [description]. Defaults to None.
     """
-    print("event:")
-    print(event)
+    log("event", event=event)
     return
 
 def pretty_print_context(context=None) -> None:
@@ -32,8 +47,7 @@ def pretty_print_context(context=None) -> None:
     Args:
         event (dict, optional): [description]. Defaults to None.
     """
-    print("context:")
-    print(context)
+    log("context", context=context)
     return
 
 def get_file_name(event: dict = None) -> str:
@@ -74,7 +88,7 @@ def copy_blob(
     # destination_bucket_name = "destination-bucket-name"
     # destination_blob_name = "destination-object-name"
 
-    storage_client = storage.Client()
+    storage_client = get_storage_client()
 
     source_bucket = storage_client.bucket(bucket_name)
     source_blob = source_bucket.blob(blob_name)
@@ -84,7 +98,7 @@ def copy_blob(
         source_blob, destination_bucket, destination_blob_name
     )
 
-    print(
+    log(
         "Blob {} in bucket {} copied to blob {} in bucket {}.".format(
             source_blob.name,
             source_bucket.name,
@@ -124,145 +138,55 @@ def get_date(filename: str):
     return formatted_date
 
 def load_condensed_masterdata(file_path: str, da_date: datetime.date, site: str, sheet_name: str = "Master Data"):
-    headers = ['WOW_MATERIAL_CODE', 'MATERIAL_DESCRIPTION', 'PRODUCT_SOURCE', 'VALUE_ADD_FLAG']
-    dtypes = {'WOW_MATERIAL_CODE': 'str',
-              'MATERIAL_DESCRIPTION': 'str',
-              'PRODUCT_SOURCE': 'str',
-              'VALUE_ADD_FLAG': 'str',
-            }
-    df = pd.read_excel(file_path, names=headers, dtype=dtypes, usecols="D:G", sheet_name=sheet_name)
-    df['filename_date'] = da_date
-    df['filename_site'] = site
-    return ("hilton_masterdata", df)
+    from schemas import load_table
+    return load_table(file_path, "hilton_masterdata", da_date, site, sheet_name)
 
 def load_service_level_data(file_path: str, da_date: datetime.date, site: str, sheet_name: str = "Service Level Data"):
-    headers = ['SERVICE_GROUP', 'PRODUCT_SOURCE', 'VALUE_ADD_FLAG', 'REASON_CODE', 'REASON_DESCRIPTION', 'SHORTAGE_QTY', 'PROMO_FLAG', 'COMMENTS', 'STATE', 'PLNT',
-               'ITEM', 'SOLD_TO_PT', 'PURCHASE_ORDER_NO', 'SOLD_TO_PARTY', 'MATERIAL', 'MATERIAL_NUMBER', 'CUSTOMER_MATERIAL_NUMBER', 'EAN_UPC', 'DC_FLAG',
-               'MAT_AV_DT', 'ORDER_QUANTITY', 'DELIVERED_QTY', 'DELIVERED_WEIGHT']
-    dtypes = {'SERVICE_GROUP': 'str', 
-              'PRODUCT_SOURCE': 'str', 
-              'VALUE_ADD_FLAG': 'str',
-              'REASON_CODE': 'str',
-              'REASON_DESCRIPTION': 'str',
-              'SHORTAGE_QTY': np.float64,
-              'PROMO_FLAG': np.float64,
-              'COMMENTS': 'str',
-              'STATE': 'str',
-              'PLNT': 'str',
-              'ITEM': 'str',
-              'SOLD_TO_PT': 'str',
-              'PURCHASE_ORDER_NO': 'str',
-              'SOLD_TO_PARTY': 'str',
-              'MATERIAL': 'str',
-              'MATERIAL_NUMBER': 'str',
-              'CUSTOMER_MATERIAL_NUMBER': 'str',
-              'EAN_UPC': 'str',
-              'DC_FLAG': 'str',
-              'ORDER_QUANTITY': np.float64,
-              'DELIVERED_QTY': np.float64,
-              'DELIVERED_WEIGHT': np.float64,
-            }
-    parse_dates = ['MAT_AV_DT']
-    df = pd.read_excel(file_path, names=headers, dtype=dtypes, parse_dates=parse_dates, usecols="A:W", sheet_name=sheet_name)
-    df['filename_date'] = da_date
-    df['filename_site'] = site
-    # drop useless rows... where ITEM is missing
-    df = df[df['ITEM'].notna()]
-    return ("hilton_servicelevel",df)
+    from schemas import load_table
+    return load_table(file_path, "hilton_servicelevel", da_date, site, sheet_name)
 
 def load_servicegroup_data(file_path: str, da_date: datetime.date, site: str, sheet_name: str = "Service Group"):
-    headers = ['DEPT', 'WOW_MATERIAL_CODE', 'MATERIAL_DESCRIPTION', 'PRODUCT_SOURCE', 'SPECIES', 'SERVICE_GROUP']
-    dtypes = {'DEPT': 'str',
-              'WOW_MATERIAL_CODE': 'str',
-              'MATERIAL_DESCRIPTION': 'str',
-              'PRODUCT_SOURCE': 'str',
-              'SPECIES': 'str',
-              'SERVICE_GROUP': 'str',
-            }
-    df = pd.read_excel(file_path, names=headers, dtype=dtypes, usecols="A:F", sheet_name=sheet_name)
-    df['filename_date'] = da_date
-    df['filename_site'] = site
-    return ("hilton_servicegroup",df)
+    from schemas import load_table
+    return load_table(file_path, "hilton_servicegroup", da_date, site, sheet_name)
 
 def load_forecast_data(file_path: str, da_date: datetime.date, site: str, sheet_name: str = "Forecast Data"):
-    headers = ['PROMO_FLAG', 'PRODUCT_SOURCE', 'PLANT', 'MATERIAL_NUMBER', 'WOWNR', 'DESCRIPTION', 'PLANT_MATERIAL_STATUS', 'DATE', 'FORECAST', 
-               'ACTUAL_SALES', 'ACTUAL_TPRP', 'LAST_OLD_TPRP', '_1_WEEK_OLD_FORECAST', '_2_WEEKS_OLD_FORECAST', '_3_WEEKS_OLD_FORECAST', 
-               '_4_WEEKS_OLD_FORECAST',	'_5_WEEKS_OLD_FORECAST', '_1_WEEK_OLD_TPRP', '_2_WEEKS_OLD_TPRP', '_3_WEEKS_OLD_TPRP',
-               '_4_WEEKS_OLD_TPRP', '_5_WEEKS_OLD_TPRP']
-    dtypes = {'PROMO_FLAG': np.float64,
-               'PRODUCT_SOURCE': 'str',
-               'PLANT': 'str',
-               'MATERIAL_NUMBER': 'str',
-               'WOWNR': 'str',
-               'DESCRIPTION': 'str',
-               'PLANT_MATERIAL_STATUS': 'str',
-               'FORECAST': np.float64, 
-               'ACTUAL_SALES': np.float64, 
-               'ACTUAL_TPRP': np.float64,
-               'LAST_OLD_TPRP': np.float64,
-               '_1_WEEK_OLD_FORECAST': np.float64,
-               '_2_WEEKS_OLD_FORECAST': np.float64,
-               '_3_WEEKS_OLD_FORECAST': np.float64, 
-               '_4_WEEKS_OLD_FORECAST': np.float64,
-               '_5_WEEKS_OLD_FORECAST': np.float64,
-               '_1_WEEK_OLD_TPRP': np.float64,
-               '_2_WEEKS_OLD_TPRP': np.float64,
-               '_3_WEEKS_OLD_TPRP': np.float64,
-               '_4_WEEKS_OLD_TPRP': np.float64,
-               '_5_WEEKS_OLD_TPRP': np.float64
-            }
-    parse_dates = ['DATE']
-    df = pd.read_excel(file_path, names=headers, dtype=dtypes, parse_dates=parse_dates, usecols="A:V", sheet_name=sheet_name)
-    df['filename_date'] = da_date
-    df['filename_site'] = site
-    # drop useless rows... where ITEM is missing
-    df = df[df['MATERIAL_NUMBER'].notna()]
-    return ("hilton_forecast",df)
+    from schemas import load_table
+    return load_table(file_path, "hilton_forecast", da_date, site, sheet_name)
 
 def load_customer_data(file_path: str, da_date: datetime.date, site: str, sheet_name: str = "Customer Master"):
-    headers = ['CUSTOMER', 'NAME', 'STATE', 'FAIR_SHARE', 'PALLET_HEI', 'LOW_CODE', 'STORE_SIZE', 'STORE_LEAD',
-               'SALES_ORG', 'DISTR_CHANNEL', 'DIVISION', 'SHIP_CONDITIONS', 'DEL_PLANT', 'DC', 'ORDER_COMB',
-               'MAX_PART_D', 'PART_DEL_PER_ITEM']
-    dtypes = {'CUSTOMER': 'str',
-              'NAME': 'str',
-              'STATE': 'str',
-              'FAIR_SHARE': 'str',
-              'PALLET_HEI': 'str',
-              'LOW_CODE': 'str',
-              'STORE_SIZE': 'str',
-              'STORE_LEAD': 'str',
-              'SALES_ORG': 'str',
-              'DISTR_CHANNEL': 'str',
-              'DIVISION': 'str',
-              'SHIP_CONDITIONS': 'str',
-              'DEL_PLANT': 'str',
-              'DC': 'str',
-              'ORDER_COMB': 'str',
-              'MAX_PART_D': 'str',
-              'PART_DEL_PER_ITEM': np.float64,
-            }
-    df = pd.read_excel(file_path, names=headers, dtype=dtypes, usecols="A:Q", sheet_name=sheet_name)
-    df['filename_date'] = da_date
-    df['filename_site'] = site
-    return ("hilton_customer", df)
+    from schemas import load_table
+    return load_table(file_path, "hilton_customer", da_date, site, sheet_name)
 
-def run(event, context):
-    """Triggered by a change to a Cloud Storage bucket.
-    Args:
-         event (dict): Event payload.
-         context (google.cloud.functions.Context): Metadata for the event.
+# loader of each table, so tables can be picked out by name
+TABLE_LOADERS = {
+    'hilton_masterdata': load_condensed_masterdata,
+    'hilton_servicelevel': load_service_level_data,
+    'hilton_servicegroup': load_servicegroup_data,
+    'hilton_forecast': load_forecast_data,
+    'hilton_customer': load_customer_data,
+}
+
+def prepare_file(event: dict, now_utc: datetime, resume: bool = False) -> dict:
     """
-    pretty_print_event(event)
-    pretty_print_context(context)
+    check, dedupe, download and copy one uploaded report.
+
+    Args:
+        event (dict): GCS event payload.
+        now_utc (datetime): upload time of this invocation.
+        resume (bool, optional): pick up the file's checkpoint from an earlier failed attempt, skipping the
+            copy and, when every table was archived, the download. Defaults to False.
 
+    Returns:
+        dict: filename, da_date, site, save_to_bucketname, file_contents_md5, file_buffer, now_utc and
+            checkpoint (None unless resume), or None when the file is skipped.
+    """
     filename = get_file_name(event)
-    print(f"Processing file: {filename}.")
-    print(filename)
+    log(f"Processing file: {filename}.", filename=filename)
     
     # if not params file then abort
     if not is_correctFileName(filename):
-        print(f"File {filename} is not correctly named. ABORTING.")
-        return
+        log(f"File {filename} is not correctly named. ABORTING.", severity='WARNING', filename=filename)
+        return None
     
     da_date = get_date(filename)
     da_date_string = da_date.strftime("%Y-%m-%d")
@@ -274,39 +198,567 @@ def run(event, context):
     
     # get params from bucket
     try:
-        client = storage.Client()
-        bucket = client.get_bucket(bucketName)
-        params_blob = bucket.get_blob(filename)
-        file_path = "/tmp/data_file.xlsx"
-        params_blob.download_to_filename(file_path)
-        print(f"{filename} saved to {file_path}")
+        with span('get_blob', filename=filename):
+            client = get_storage_client()
+            bucket = client.get_bucket(bucketName)
+            params_blob = bucket.get_blob(filename)
+            # hash time. GCS already knows the md5, so duplicates are caught before anything is downloaded
+            file_contents_md5 = blob_md5_hexdigest(params_blob)
     except:
-        print(f"{filename} does not exist. ABORTING.")
-        return
-    
-    saveFileName = now_utc.strftime("%Y%m%d_%H:%M:%S")+"_"+filename
-    copy_blob(bucket_name=bucketName, blob_name=filename, destination_bucket_name=save_to_bucketname, destination_blob_name=saveFileName)
+        log(f"{filename} does not exist. ABORTING.", severity='WARNING', filename=filename)
+        return None
+
+    file_buffer = None
+    if file_contents_md5 is None:
+        # composite objects carry no md5, hash the downloaded buffer instead
+        with span('download', filename=filename) as metrics:
+            file_buffer = download_to_buffer(params_blob)
+            metrics['bytes'] = file_buffer.getbuffer().nbytes
+        with span('hash', filename=filename):
+            file_contents_md5 = buffer_md5_hexdigest(file_buffer)
+
+    with span('ledger_check', filename=filename, file_contents_md5=file_contents_md5) as metrics:
+        ledger = get_ledger(get_bigquery_client())
+        metrics['seen'] = ledger is not None and ledger.seen(file_contents_md5)
+    if metrics['seen']:
+        log(f"{filename} ({file_contents_md5}) was already ingested. SKIPPING.", filename=filename, file_contents_md5=file_contents_md5)
+        return None
+
+    checkpoint = None
+    if resume:
+        from checkpoint import get_checkpoint
+        checkpoint = get_checkpoint("gs://" + save_to_bucketname + "/checkpoints", file_contents_md5)
+        if checkpoint.resumed:
+            log(f"resuming {filename} ({file_contents_md5}) from its checkpoint", filename=filename, file_contents_md5=file_contents_md5, checkpoint=checkpoint.state)
+
+    # a resumed file whose every table was archived is read back from the archives instead
+    needs_workbook = checkpoint is None or 'skipped' not in checkpoint.state or any(
+        checkpoint.archive(tbl_name) is None for tbl_name in TABLE_LOADERS if tbl_name not in checkpoint.state['skipped'])
+    if file_buffer is None and needs_workbook:
+        # download once into memory, the excel parser reads straight from this buffer
+        with span('download', filename=filename) as metrics:
+            file_buffer = download_to_buffer(params_blob)
+            metrics['bytes'] = file_buffer.getbuffer().nbytes
     
-    # hash time
-    file_contents_md5 = hashlib.md5(open(file_path,'rb').read()).hexdigest()
+    if checkpoint is None or not checkpoint.resumed:
+        saveFileName = now_utc.strftime("%Y%m%d_%H:%M:%S")+"_"+filename
+        with span('copy_blob', filename=filename):
+            copy_blob(bucket_name=bucketName, blob_name=filename, destination_bucket_name=save_to_bucketname, destination_blob_name=saveFileName)
+        if checkpoint is not None:
+            checkpoint.state['copied'] = True
+
+    return {
+        'filename': filename,
+        'da_date': da_date,
+        'site': site,
+        'save_to_bucketname': save_to_bucketname,
+        'file_contents_md5': file_contents_md5,
+        'file_buffer': file_buffer,
+        'now_utc': now_utc,
+        'checkpoint': checkpoint,
+    }
+
+def add_upload_columns(df: 'pd.DataFrame', upload: dict) -> 'pd.DataFrame':
+    from schemas import constant_column
+    df['upload_utc_dt'] = upload['now_utc']
+    df['filename'] = constant_column(upload['filename'], len(df))
+    df['file_contents_md5'] = constant_column(upload['file_contents_md5'], len(df))
+    return df
+
+def upload_table(df: 'pd.DataFrame', tbl_name: str) -> 'pa.Table':
+    """
+    convert a table to arrow once, for both its archive and its load job.
+    """
+    from schemas import arrow_schema
+    from archive import to_arrow_table
+    with span('to_arrow', table=tbl_name) as metrics:
+        table = to_arrow_table(df, arrow_schema(tbl_name))
+        metrics['rows'] = table.num_rows
+        metrics['bytes'] = table.nbytes
+    return table
+
+def archive_location(upload: dict, tbl_name: str, tag: str = "") -> str:
+    saveFileName = upload['now_utc'].strftime("%Y%m%d_%H:%M:%S")+"_"+upload['site']+tag+"_"+tbl_name
+    return "gs://" + upload['save_to_bucketname'] + "/" + saveFileName
+
+def stream_table(upload: dict, tbl_name: str, tag: str = "", builders: list = ()) -> str:
+    """
+    stream a table's sheet in row chunks straight into its parquet archive, adding each chunk to builders.
+
+    Returns:
+        str: gs:// path of the archive, ready for a load job.
+    """
+    from workbook import iter_sheet_chunks
+    from schemas import arrow_schema
+    from archive import ParquetStreamWriter
+
+    with span('stream', table=tbl_name) as metrics:
+        writer = ParquetStreamWriter(archive_location(upload, tbl_name, tag), arrow_schema(tbl_name))
+        for chunk in iter_sheet_chunks(upload['file_buffer'], tbl_name, upload['da_date'], upload['site']):
+            writer.write(add_upload_columns(chunk, upload))
+            for builder in builders:
+                builder.add(tbl_name, chunk)
+        metrics['rows'] = writer.rows
+        return writer.close()
+
+def load_job_config(tbl_name: str) -> 'bigquery.LoadJobConfig':
+    from google.cloud import bigquery
+    from schemas import bigquery_schema
+    from scd import INCREMENTAL_TABLES, scd_bigquery_schema
+
+    if tbl_name in INCREMENTAL_TABLES:
+        # row_hash, change_type and valid_from are added to the table by its first incremental load
+        return bigquery.LoadJobConfig(
+            write_disposition="WRITE_APPEND",
+            schema=scd_bigquery_schema(tbl_name),
+            schema_update_options=[bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION],
+        )
+    return bigquery.LoadJobConfig(write_disposition="WRITE_APPEND", schema=bigquery_schema(tbl_name))
+
+def destination(bq_client, tbl_name: str) -> str:
+    """
+    dataset.table to load tbl_name into, created partitioned and clustered if it does not exist yet.
+    """
+    from schemas import bigquery_table
+    from scd import INCREMENTAL_TABLES, scd_bigquery_schema
+    from bq_loader import ensure_table
+
+    schema = scd_bigquery_schema(tbl_name) if tbl_name in INCREMENTAL_TABLES else None
+    ensure_table(bq_client, bigquery_table(tbl_name, f"{bq_client.project}.hilton.{tbl_name}", schema))
+    return f'hilton.{tbl_name}'
+
+def replace_slices(tbl_name: str, uploads: list) -> list:
+    """
+    (filename_date, filename_site) slices a load of uploads replaces. Incremental tables only ever
+    append, their rows are changes against the previous snapshot.
+    """
+    from scd import INCREMENTAL_TABLES
+    if tbl_name in INCREMENTAL_TABLES:
+        return None
+    return [(upload['da_date'], upload['site']) for upload in uploads]
+
+def derived_builders() -> list:
+    """
+    builders of the tables derived from the hilton_* frames at ingest: KPI summaries and forecast horizons.
+    Each takes every frame or streamed chunk in add(tbl_name, df) and hands back {tbl_name: df} from tables().
+    """
+    from kpis import SummaryBuilder, SUMMARIES_ENABLED
+    from horizons import HorizonBuilder, HORIZONS_ENABLED
+    builders = []
+    if SUMMARIES_ENABLED:
+        builders.append(SummaryBuilder())
+    if HORIZONS_ENABLED:
+        builders.append(HorizonBuilder())
+    return builders
+
+def submit_derived(loads: 'bq_loader.LoadCoordinator', bq_client, builders: list) -> list:
+    """
+    load the derived tables, replacing the (filename_date, filename_site) slices they cover.
+
+    Returns:
+        list: names of the derived tables submitted.
+    """
+    from google.cloud import bigquery
+    from schemas import bigquery_table, BIGQUERY_TYPES
+    from bq_loader import ensure_table
+
+    submitted = []
+    for builder in builders:
+        with span('derive', builder=type(builder).__name__) as metrics:
+            tables = builder.tables()
+            metrics.update({tbl_name: len(df) for tbl_name, df in tables.items()})
+        for tbl_name, df in tables.items():
+            schema = [bigquery.SchemaField(col, BIGQUERY_TYPES[col_type]) for col, col_type in builder.columns(tbl_name)]
+            ensure_table(bq_client, bigquery_table(tbl_name, f"{bq_client.project}.hilton.{tbl_name}", schema, builder.cluster(tbl_name)))
+            slices = list(df[['filename_date', 'filename_site']].drop_duplicates().itertuples(index=False, name=None))
+            job_config = bigquery.LoadJobConfig(write_disposition="WRITE_APPEND", schema=schema)
+            loads.submit(df, f'hilton.{tbl_name}', job_config=job_config, replace=slices)
+            submitted.append(tbl_name)
+    return submitted
+
+def snapshot_index(upload: dict) -> 'scd.SnapshotIndex':
+    from scd import get_snapshot_index
+    return get_snapshot_index("gs://" + upload['save_to_bucketname'] + "/snapshots")
+
+def incremental_rows(df: 'pd.DataFrame', tbl_name: str, upload: dict) -> 'pd.DataFrame':
+    """
+    rows of df to load into BigQuery: all of them, or for HILTON_INCREMENTAL_TABLES only those
+    inserted, changed or removed since the site's last snapshot.
+    """
+    from scd import INCREMENTAL_TABLES, diff_snapshot
+
+    if tbl_name not in INCREMENTAL_TABLES:
+        return df
+    snapshots = snapshot_index(upload)
+    with span('change_detection', table=tbl_name) as metrics:
+        changes, index = diff_snapshot(df, tbl_name, snapshots.get(tbl_name, upload['site']))
+        snapshots.put(tbl_name, upload['site'], index)
+        metrics['rows'] = len(df)
+        metrics['changed_rows'] = len(changes)
+    # tombstones of removed keys need the upload columns too
+    return add_upload_columns(changes, upload)
+
+def loaded_tables(loads: 'bq_loader.LoadCoordinator') -> list:
+    """
+    table names whose load jobs succeeded in the last loads.wait(), even when it raised.
+    """
+    return [stats['table'].split('.', 1)[1] for stats in loads.report if stats['error'] is None]
+
+def snapshot_indexes(uploads: list) -> list:
+    return list({id(index): index for index in map(snapshot_index, uploads)}.values())
+
+def wait_for_loads(loads: 'bq_loader.LoadCoordinator', uploads: list, **fields) -> None:
+    """
+    wait for the load jobs, then keep the snapshot indexes staged by incremental_rows only for the tables
+    whose load succeeded. An index staged for a table that was never submitted or failed is dropped.
+    """
+    with span('bigquery_load_wait', **fields):
+        try:
+            loads.wait()
+        finally:
+            for index in snapshot_indexes(uploads):
+                index.flush(loaded_tables(loads))
+
+def discard_snapshots(uploads: list) -> None:
+    """
+    drop snapshot indexes staged by incremental_rows but never flushed, e.g. when parsing or submitting
+    raised, so the next run in this warm process diffs against the last loaded snapshot.
+    """
+    for index in snapshot_indexes(uploads):
+        index.discard()
+
+def submit_table(loads: 'bq_loader.LoadCoordinator', bq_client, upload: dict, tbl_name: str, df: 'pd.DataFrame', table: 'pa.Table') -> None:
+    """
+    load one parsed table of an upload, only the changed rows of incremental tables.
+    """
+    from scd import INCREMENTAL_TABLES
+    if tbl_name in INCREMENTAL_TABLES:
+        loads.submit(incremental_rows(df, tbl_name, upload), destination(bq_client, tbl_name), job_config=load_job_config(tbl_name))
+    else:
+        loads.submit_arrow(table, destination(bq_client, tbl_name), job_config=load_job_config(tbl_name), replace=replace_slices(tbl_name, [upload]))
+
+def archive_frames(path: str, tbl_name: str, chunked: bool = False):
+    """
+    read back a table's parquet archive as (df, table) pairs: the whole table, or for streamed tables
+    HILTON_CHUNK_ROWS record batches read one at a time, so memory stays flat as in stream_table.
+    """
+    import fsspec
+    import pyarrow.parquet as pq
+    from schemas import set_dtypes
+    from workbook import CHUNK_ROWS
+    with fsspec.open(path, 'rb') as f:
+        if not chunked:
+            table = pq.read_table(f)
+            yield set_dtypes(table.to_pandas(), tbl_name), table
+            return
+        for batch in pq.ParquetFile(f).iter_batches(batch_size=CHUNK_ROWS):
+            yield set_dtypes(batch.to_pandas(), tbl_name), batch
+
+def checkpoint_callbacks(checkpoint: 'checkpoint.Checkpoint') -> tuple:
+    """
+    on_done callbacks for run()'s LoadCoordinator and ArchiveWriter, saving the checkpoint as each load and
+    archive finishes rather than once everything did, so a run killed by its timeout still keeps them.
+
+    Returns:
+        tuple: (on_load_done, on_archive_done)
+    """
+    def on_load_done(stats: dict) -> None:
+        tbl_name = stats['table'].split('.', 1)[1]
+        if tbl_name in TABLE_LOADERS:
+            checkpoint.mark(tbl_name, loaded=True)
+
+    def on_archive_done(path: str) -> None:
+        for tbl_name in TABLE_LOADERS:
+            if path.endswith("_" + tbl_name + ".parquet"):
+                checkpoint.mark(tbl_name, archive=path)
+
+    return on_load_done, on_archive_done
+
+def wait_for_run(loads: 'bq_loader.LoadCoordinator', archives: 'archive.ArchiveWriter', upload: dict, derived: list = None) -> None:
+    """
+    wait for the loads and archives of run(), then record in the upload's checkpoint which tables were
+    archived and loaded, so a retry after a failure only redoes the rest. checkpoint_callbacks saved each
+    of them already as it finished, this also records the derived tables.
+
+    Args:
+        loads (bq_loader.LoadCoordinator): holding the run's load jobs.
+        archives (archive.ArchiveWriter): holding the run's archives.
+        upload (dict): as returned by prepare_file(resume=True).
+        derived (list, optional): derived tables submitted, None when run() failed before submitting them.
+
+    Raises:
+        RuntimeError: the first load or archive failure, after the checkpoint is saved.
+    """
+    checkpoint = upload['checkpoint']
+    failures = []
+    try:
+        wait_for_loads(loads, [upload])
+    except Exception as e:
+        failures.append(e)
+    try:
+        with span('archive_wait'):
+            archives.wait()
+    except Exception as e:
+        failures.append(e)
+
+    loaded = loaded_tables(loads)
+    for tbl_name in TABLE_LOADERS:
+        if tbl_name in loaded:
+            checkpoint.table(tbl_name)['loaded'] = True
+        for stats in archives.report:
+            if stats['error'] is None and stats['path'].endswith("_" + tbl_name + ".parquet"):
+                checkpoint.table(tbl_name)['archive'] = stats['path']
+    if derived is not None and set(derived) <= set(loaded):
+        checkpoint.state['derived_loaded'] = True
+    checkpoint.save()
+    if failures:
+        raise failures[0]
+
+def unchanged_tables(upload: dict, ledger, pending: dict = None) -> list:
+    """
+    tables of HILTON_SKIP_UNCHANGED_TABLES whose sheet is identical to the one last loaded for the site.
+
+    Their fingerprints are kept in upload['sheet_fingerprints'] and recorded once the file is loaded.
+
+    Args:
+        upload (dict): as returned by prepare_file.
+        ledger (CachedLedger): holds the last fingerprints per site, None disables skipping.
+        pending (dict, optional): {site: {sheet_name: fingerprint}} of earlier files in the same batch.
+
+    Returns:
+        list: table names to skip.
+    """
+    from workbook import SKIP_UNCHANGED_TABLES, sheet_fingerprints
+    from schemas import TABLES
+
+    upload['sheet_fingerprints'] = {}
+    if not SKIP_UNCHANGED_TABLES or ledger is None:
+        return []
+    sheet_tables = {TABLES[tbl_name]['sheet_name']: tbl_name for tbl_name in SKIP_UNCHANGED_TABLES}
+    with span('fingerprint') as metrics:
+        upload['sheet_fingerprints'] = sheet_fingerprints(upload['file_buffer'], list(sheet_tables))
+        last = dict(ledger.last_sheet_fingerprints(upload['site']))
+        last.update((pending or {}).get(upload['site'], {}))
+        unchanged = [sheet_tables[sheet_name] for sheet_name, fingerprint in upload['sheet_fingerprints'].items() if last.get(sheet_name) == fingerprint]
+        metrics['unchanged'] = unchanged
+    return unchanged
+
+def parse_upload(upload: dict, ledger, pending: dict, tag: str) -> tuple:
+    """
+    parse every table of one file of run_batch, before any of it is loaded or summarised, so a workbook
+    that fails to parse can be left out of the batch.
+
+    Args:
+        upload (dict): as returned by prepare_file.
+        ledger (CachedLedger): for unchanged_tables.
+        pending (dict): fingerprints of earlier files in the batch, for unchanged_tables.
+        tag (str): appended to the archive names.
+
+    Returns:
+        tuple: ([(tbl_name, df, table)] of the tables read whole, [(tbl_name, path)] of the streamed tables' archives).
+    """
+    from workbook import iter_tables, STREAM_TABLES
+    skipped = unchanged_tables(upload, ledger, pending)
+    func_2_run = [func for tbl_name, func in TABLE_LOADERS.items() if tbl_name not in STREAM_TABLES + skipped]
+    tables = []
+    for tbl_name, df in iter_tables(func_2_run, upload['file_buffer'], upload['da_date'], upload['site']):
+        add_upload_columns(df, upload)
+        tables.append((tbl_name, df, upload_table(df, tbl_name)))
+    streamed = [(tbl_name, stream_table(upload, tbl_name, tag)) for tbl_name in STREAM_TABLES if tbl_name not in skipped]
+    return (tables, streamed)
+
+def get_event(message: dict) -> dict:
+    """
+    GCS event from a Pub/Sub message (notification JSON, base64 encoded in data), or the event itself.
+    """
+    message = message.get('message', message)
+    if 'name' not in message and 'data' in message:
+        return json.loads(base64.b64decode(message['data']))
+    return message
+
+@profiled
+def run(event, context):
+    """Triggered by a change to a Cloud Storage bucket.
+    Args:
+         event (dict): Event payload.
+         context (google.cloud.functions.Context): Metadata for the event.
+    """
+    pretty_print_event(event)
+    pretty_print_context(context)
+
+    # timezone aware object, unlike datetime.utcnow(). Taken per invocation, warm instances reuse the module.
+    now_utc = datetime.now(timezone.utc)
+    upload = prepare_file(event, now_utc, resume=True)
+    if upload is None:
+        return
+
+    from workbook import iter_tables, STREAM_TABLES
+    from bq_loader import LoadCoordinator
+    from archive import ArchiveWriter
+
+    bq_client = get_bigquery_client()
+    ledger = get_ledger(bq_client)
+    # what an earlier attempt on this file already archived and loaded is not redone
+    checkpoint = upload['checkpoint']
+    builders = [] if checkpoint.state.get('derived_loaded') else derived_builders()
+    # sheets identical to the ones loaded last time for this site are neither parsed nor loaded
+    if 'skipped' in checkpoint.state:
+        skipped = checkpoint.state['skipped']
+        upload['sheet_fingerprints'] = checkpoint.state['sheet_fingerprints']
+    else:
+        skipped = unchanged_tables(upload, ledger)
+        checkpoint.state.update(skipped=skipped, sheet_fingerprints=upload['sheet_fingerprints'])
+    sources = set().union(*[builder.sources for builder in builders])
+    # archived tables are read back instead of parsed, if they still need loading or feed a derived table
+    archived = [tbl_name for tbl_name in TABLE_LOADERS if tbl_name not in skipped and checkpoint.archive(tbl_name) is not None
+                and (not checkpoint.loaded(tbl_name) or tbl_name in sources)]
     
-    func_2_run = [load_condensed_masterdata, load_service_level_data, load_servicegroup_data, load_forecast_data, load_customer_data]
-    for func in func_2_run:
-        tbl_name, df = func(file_path, da_date, site)
-        df['upload_utc_dt'] = now_utc
-        df['filename'] = filename
-        df['file_contents_md5'] = file_contents_md5
-        # save to BQ 
-        bq_ds_tbl = f'hilton.{tbl_name}'
-        print(f"writing {bq_ds_tbl}")
-        client = bigquery.Client(project=PROJECT_ID)
-        job_config = bigquery.LoadJobConfig(write_disposition="WRITE_APPEND")
-        job = client.load_table_from_dataframe(df, bq_ds_tbl, job_config=job_config)
-        # save to cloud storage
-        saveFileName = now_utc.strftime("%Y%m%d_%H:%M:%S")+"_"+site+"_"+tbl_name
-        saveLocation = "gs://" + save_to_bucketname + "/" + saveFileName
-        df.to_csv(saveLocation+'.csv', index=False)
-        df.to_pickle(saveLocation+'.pk')
+    # tables in HILTON_STREAM_TABLES are streamed in row chunks below instead of read whole
+    func_2_run = [func for tbl_name, func in TABLE_LOADERS.items() if tbl_name not in STREAM_TABLES + skipped and checkpoint.archive(tbl_name) is None]
+    # one client for every table, the load jobs and parquet archives run concurrently and are awaited together below
+    on_load_done, on_archive_done = checkpoint_callbacks(checkpoint)
+    loads = LoadCoordinator(bq_client, on_done=on_load_done)
+    archives = ArchiveWriter(on_done=on_archive_done)
+    derived = None
+    try:
+        for tbl_name in archived:
+            for df, table in archive_frames(checkpoint.archive(tbl_name), tbl_name, chunked=tbl_name in STREAM_TABLES):
+                if tbl_name not in STREAM_TABLES and not checkpoint.loaded(tbl_name):
+                    submit_table(loads, bq_client, upload, tbl_name, df, table)
+                for builder in builders:
+                    builder.add(tbl_name, df)
+            if tbl_name in STREAM_TABLES and not checkpoint.loaded(tbl_name):
+                loads.submit_uri(checkpoint.archive(tbl_name), destination(bq_client, tbl_name), job_config=load_job_config(tbl_name), replace=replace_slices(tbl_name, [upload]))
+
+        # sheets are parsed serially or across HILTON_PARSE_WORKERS processes, whichever finishes first is written first
+        for tbl_name, df in iter_tables(func_2_run, upload['file_buffer'], upload['da_date'], upload['site']):
+            add_upload_columns(df, upload)
+            table = upload_table(df, tbl_name)
+            # save to cloud storage, always the whole sheet
+            archives.submit(table, archive_location(upload, tbl_name))
+            # save to BQ, unless an earlier attempt loaded it but failed to archive it
+            if not checkpoint.loaded(tbl_name):
+                submit_table(loads, bq_client, upload, tbl_name, df, table)
+            for builder in builders:
+                builder.add(tbl_name, df)
+
+        for tbl_name in [tbl_name for tbl_name in STREAM_TABLES if tbl_name not in skipped and checkpoint.archive(tbl_name) is None]:
+            # each chunk goes straight into the parquet archive, which BigQuery then loads from GCS
+            path = stream_table(upload, tbl_name, builders=builders)
+            checkpoint.mark(tbl_name, archive=path)
+            if not checkpoint.loaded(tbl_name):
+                loads.submit_uri(path, destination(bq_client, tbl_name), job_config=load_job_config(tbl_name), replace=replace_slices(tbl_name, [upload]))
+
+        derived = submit_derived(loads, bq_client, builders)
+    finally:
+        # whatever finished is checkpointed, even when a later table failed to parse or load
+        try:
+            wait_for_run(loads, archives, upload, derived)
+        finally:
+            discard_snapshots([upload])
+
+    if ledger is not None:
+        ledger.record(upload['file_contents_md5'], upload['site'], upload['da_date'], upload['filename'])
+        if upload['sheet_fingerprints']:
+            ledger.record_sheets(upload['site'], upload['filename'], upload['sheet_fingerprints'])
+    checkpoint.clear()
+
+@profiled
+def run_batch(events: list, context=None):
+    """
+    ingest a burst of uploads in one invocation, e.g. a Pub/Sub pull batch of GCS notifications.
+
+    Every file is checked, archived and parsed as in run(), but each hilton_* table gets a single
+    load job for the whole batch instead of one per file.
+
+    Args:
+         events (list): GCS event payloads or Pub/Sub messages carrying them.
+         context (google.cloud.functions.Context, optional): Metadata for the invocation.
+    """
+    pretty_print_context(context)
+
+    now_utc = datetime.now(timezone.utc)
+    uploads = []
+    for event in events:
+        event = get_event(event)
+        pretty_print_event(event)
+        upload = prepare_file(event, now_utc)
+        # the same file can be queued twice within one batch too
+        if upload is not None and upload['file_contents_md5'] not in [other['file_contents_md5'] for other in uploads]:
+            uploads.append(upload)
+    if not uploads:
+        return
+
+    import pandas as pd
+    import pyarrow as pa
+    from workbook import STREAM_TABLES
+    from bq_loader import LoadCoordinator
+    from archive import ArchiveWriter
+    from scd import INCREMENTAL_TABLES
+
+    bq_client = get_bigquery_client()
+    ledger = get_ledger(bq_client)
+    builders = derived_builders()
+    loads = LoadCoordinator(bq_client)
+    archives = ArchiveWriter()
+    # arrow tables, or for incremental tables DataFrames of changed rows
+    frames = {tbl_name: [] for tbl_name in TABLE_LOADERS if tbl_name not in STREAM_TABLES}
+    uris = {tbl_name: [] for tbl_name in STREAM_TABLES}
+    # uploads each table's load carries, whose slices it replaces
+    loaded = {tbl_name: [] for tbl_name in TABLE_LOADERS}
+    # oldest report first, so incremental tables are diffed in order
+    uploads.sort(key=lambda upload: upload['da_date'])
+    fingerprints = {}
+    try:
+        for upload in list(uploads):
+            # archives stay one per file, named by report date so files from one site do not collide
+            tag = "_" + upload['da_date'].strftime("%Y%m%d")
+            try:
+                tables, streamed = parse_upload(upload, ledger, fingerprints, tag)
+            except Exception as e:
+                # one unreadable workbook must not hold back the rest, nor fail every redelivery of the batch
+                log(f"could not parse {upload['filename']}, SKIPPING it", severity='ERROR', filename=upload['filename'],
+                    file_contents_md5=upload['file_contents_md5'], error=f"{type(e).__name__}: {e}")
+                uploads.remove(upload)
+                continue
+            finally:
+                upload['file_buffer'] = None
+            fingerprints.setdefault(upload['site'], {}).update(upload['sheet_fingerprints'])
+            for tbl_name, df, table in tables:
+                archives.submit(table, archive_location(upload, tbl_name, tag))
+                frames[tbl_name].append(incremental_rows(df, tbl_name, upload) if tbl_name in INCREMENTAL_TABLES else table)
+                loaded[tbl_name].append(upload)
+                for builder in builders:
+                    builder.add(tbl_name, df)
+            for tbl_name, path in streamed:
+                uris[tbl_name].append(path)
+                loaded[tbl_name].append(upload)
+                # the archive is read back in chunks, so a file is only summarised once all of it parsed
+                for df, table in archive_frames(path, tbl_name, chunked=True) if builders else ():
+                    for builder in builders:
+                        builder.add(tbl_name, df)
+
+        # tables skipped in every file of the batch have nothing to load
+        for tbl_name, parts in [(tbl_name, parts) for tbl_name, parts in frames.items() if parts]:
+            if tbl_name in INCREMENTAL_TABLES:
+                loads.submit(pd.concat(parts, ignore_index=True), destination(bq_client, tbl_name), job_config=load_job_config(tbl_name))
+            else:
+                loads.submit_arrow(pa.concat_tables(parts), destination(bq_client, tbl_name), job_config=load_job_config(tbl_name), replace=replace_slices(tbl_name, loaded[tbl_name]))
+        for tbl_name, paths in [(tbl_name, paths) for tbl_name, paths in uris.items() if paths]:
+            loads.submit_uri(paths, destination(bq_client, tbl_name), job_config=load_job_config(tbl_name), replace=replace_slices(tbl_name, loaded[tbl_name]))
+
+        submit_derived(loads, bq_client, builders)
+
+        wait_for_loads(loads, uploads, files=len(uploads))
+        with span('archive_wait', files=len(uploads)):
+            archives.wait()
+    finally:
+        discard_snapshots(uploads)
+    if ledger is not None:
+        for upload in uploads:
+            ledger.record(upload['file_contents_md5'], upload['site'], upload['da_date'], upload['filename'])
+            if upload['sheet_fingerprints']:
+                ledger.record_sheets(upload['site'], upload['filename'], upload['sheet_fingerprints'])
 
 if __name__ == "__main__":
     run()
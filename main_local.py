@@ -3,11 +3,17 @@ import re
 import pandas as pd
 import numpy as np
 from google.cloud import bigquery
+from google.api_core.exceptions import NotFound
 from google.oauth2 import service_account
 import pandas_gbq
 from datetime import datetime,timezone
-import hashlib
 import openpyxl
+from workbook import iter_tables
+from schemas import load_table
+from gcs_io import file_md5_hexdigest
+from instrumentation import log, span, profiled
+from mirror import get_mirror
+from bq_loader import delete_slices, replaceable_slices
 
 #### Declare functions
 def is_correctFileName(fileName: str = None, regex: str = r".*service level report.*xls[x]?$") -> bool:
@@ -58,127 +64,19 @@ def get_date(filename: str):
     return formatted_date
 
 def load_condensed_masterdata(file_path: str, da_date: datetime.date, site: str, sheet_name: str = "Master Data"):
-    headers = ['WOW_MATERIAL_CODE', 'MATERIAL_DESCRIPTION', 'PRODUCT_SOURCE', 'VALUE_ADD_FLAG']
-    dtypes = {'WOW_MATERIAL_CODE': 'str',
-              'MATERIAL_DESCRIPTION': 'str',
-              'PRODUCT_SOURCE': 'str',
-              'VALUE_ADD_FLAG': 'str',
-            }
-    df = pd.read_excel(file_path, names=headers, dtype=dtypes, usecols="D:G", sheet_name=sheet_name)
-    df['filename_date'] = da_date
-    df['filename_site'] = site
-    return ("hilton_masterdata", df)
+    return load_table(file_path, "hilton_masterdata", da_date, site, sheet_name)
 
 def load_service_level_data(file_path: str, da_date: datetime.date, site: str, sheet_name: str = "Service Level Data"):
-    headers = ['SERVICE_GROUP', 'PRODUCT_SOURCE', 'VALUE_ADD_FLAG', 'REASON_CODE', 'REASON_DESCRIPTION', 'SHORTAGE_QTY', 'PROMO_FLAG', 'COMMENTS', 'STATE', 'PLNT',
-               'ITEM', 'SOLD_TO_PT', 'PURCHASE_ORDER_NO', 'SOLD_TO_PARTY', 'MATERIAL', 'MATERIAL_NUMBER', 'CUSTOMER_MATERIAL_NUMBER', 'EAN_UPC', 'DC_FLAG',
-               'MAT_AV_DT', 'ORDER_QUANTITY', 'DELIVERED_QTY', 'DELIVERED_WEIGHT']
-    dtypes = {'SERVICE_GROUP': 'str', 
-              'PRODUCT_SOURCE': 'str', 
-              'VALUE_ADD_FLAG': 'str',
-              'REASON_CODE': 'str',
-              'REASON_DESCRIPTION': 'str',
-              'SHORTAGE_QTY': np.float64,
-              'PROMO_FLAG': np.float64,
-              'COMMENTS': 'str',
-              'STATE': 'str',
-              'PLNT': 'str',
-              'ITEM': 'str',
-              'SOLD_TO_PT': 'str',
-              'PURCHASE_ORDER_NO': 'str',
-              'SOLD_TO_PARTY': 'str',
-              'MATERIAL': 'str',
-              'MATERIAL_NUMBER': 'str',
-              'CUSTOMER_MATERIAL_NUMBER': 'str',
-              'EAN_UPC': 'str',
-              'DC_FLAG': 'str',
-              'ORDER_QUANTITY': np.float64,
-              'DELIVERED_QTY': np.float64,
-              'DELIVERED_WEIGHT': np.float64,
-            }
-    parse_dates = ['MAT_AV_DT']
-    df = pd.read_excel(file_path, names=headers, dtype=dtypes, parse_dates=parse_dates, usecols="A:W", sheet_name=sheet_name)
-    df['filename_date'] = da_date
-    df['filename_site'] = site
-    # drop useless rows... where ITEM is missing
-    df = df[df['ITEM'].notna()]
-    return ("hilton_servicelevel",df)
+    return load_table(file_path, "hilton_servicelevel", da_date, site, sheet_name)
 
 def load_servicegroup_data(file_path: str, da_date: datetime.date, site: str, sheet_name: str = "Service Group"):
-    headers = ['DEPT', 'WOW_MATERIAL_CODE', 'MATERIAL_DESCRIPTION', 'PRODUCT_SOURCE', 'SPECIES', 'SERVICE_GROUP']
-    dtypes = {'DEPT': 'str',
-              'WOW_MATERIAL_CODE': 'str',
-              'MATERIAL_DESCRIPTION': 'str',
-              'PRODUCT_SOURCE': 'str',
-              'SPECIES': 'str',
-              'SERVICE_GROUP': 'str',
-            }
-    df = pd.read_excel(file_path, names=headers, dtype=dtypes, usecols="A:F", sheet_name=sheet_name)
-    df['filename_date'] = da_date
-    df['filename_site'] = site
-    return ("hilton_servicegroup",df)
+    return load_table(file_path, "hilton_servicegroup", da_date, site, sheet_name)
 
 def load_forecast_data(file_path: str, da_date: datetime.date, site: str, sheet_name: str = "Forecast Data"):
-    headers = ['PROMO_FLAG', 'PRODUCT_SOURCE', 'PLANT', 'MATERIAL_NUMBER', 'WOWNR', 'DESCRIPTION', 'PLANT_MATERIAL_STATUS', 'DATE', 'FORECAST', 
-               'ACTUAL_SALES', 'ACTUAL_TPRP', 'LAST_OLD_TPRP', '_1_WEEK_OLD_FORECAST', '_2_WEEKS_OLD_FORECAST', '_3_WEEKS_OLD_FORECAST', 
-               '_4_WEEKS_OLD_FORECAST',	'_5_WEEKS_OLD_FORECAST', '_1_WEEK_OLD_TPRP', '_2_WEEKS_OLD_TPRP', '_3_WEEKS_OLD_TPRP',
-               '_4_WEEKS_OLD_TPRP', '_5_WEEKS_OLD_TPRP']
-    dtypes = {'PROMO_FLAG': np.float64,
-               'PRODUCT_SOURCE': 'str',
-               'PLANT': 'str',
-               'MATERIAL_NUMBER': 'str',
-               'WOWNR': 'str',
-               'DESCRIPTION': 'str',
-               'PLANT_MATERIAL_STATUS': 'str',
-               'FORECAST': np.float64, 
-               'ACTUAL_SALES': np.float64, 
-               'ACTUAL_TPRP': np.float64,
-               'LAST_OLD_TPRP': np.float64,
-               '_1_WEEK_OLD_FORECAST': np.float64,
-               '_2_WEEKS_OLD_FORECAST': np.float64,
-               '_3_WEEKS_OLD_FORECAST': np.float64, 
-               '_4_WEEKS_OLD_FORECAST': np.float64,
-               '_5_WEEKS_OLD_FORECAST': np.float64,
-               '_1_WEEK_OLD_TPRP': np.float64,
-               '_2_WEEKS_OLD_TPRP': np.float64,
-               '_3_WEEKS_OLD_TPRP': np.float64,
-               '_4_WEEKS_OLD_TPRP': np.float64,
-               '_5_WEEKS_OLD_TPRP': np.float64
-            }
-    parse_dates = ['DATE']
-    df = pd.read_excel(file_path, names=headers, dtype=dtypes, parse_dates=parse_dates, usecols="A:V", sheet_name=sheet_name)
-    df['filename_date'] = da_date
-    df['filename_site'] = site
-    # drop useless rows... where ITEM is missing
-    df = df[df['MATERIAL_NUMBER'].notna()]
-    return ("hilton_forecast",df)
+    return load_table(file_path, "hilton_forecast", da_date, site, sheet_name)
 
 def load_customer_data(file_path: str, da_date: datetime.date, site: str, sheet_name: str = "Customer Master"):
-    headers = ['CUSTOMER', 'NAME', 'STATE', 'FAIR_SHARE', 'PALLET_HEI', 'LOW_CODE', 'STORE_SIZE', 'STORE_LEAD',
-               'SALES_ORG', 'DISTR_CHANNEL', 'DIVISION', 'SHIP_CONDITIONS', 'DEL_PLANT', 'DC', 'ORDER_COMB',
-               'MAX_PART_D', 'PART_DEL_PER_ITEM']
-    dtypes = {'CUSTOMER': 'str',
-              'NAME': 'str',
-              'STATE': 'str',
-              'FAIR_SHARE': 'str',
-              'PALLET_HEI': 'str',
-              'LOW_CODE': 'str',
-              'STORE_SIZE': 'str',
-              'STORE_LEAD': 'str',
-              'SALES_ORG': 'str',
-              'DISTR_CHANNEL': 'str',
-              'DIVISION': 'str',
-              'SHIP_CONDITIONS': 'str',
-              'DEL_PLANT': 'str',
-              'DC': 'str',
-              'ORDER_COMB': 'str',
-              'MAX_PART_D': 'str',
-              'PART_DEL_PER_ITEM': np.float64,
-            }
-    df = pd.read_excel(file_path, names=headers, dtype=dtypes, usecols="A:Q", sheet_name=sheet_name)
-    df['filename_date'] = da_date
-    df['filename_site'] = site
-    return ("hilton_customer", df)
+    return load_table(file_path, "hilton_customer", da_date, site, sheet_name)
 
 ### Save to bigquery
 def get_bq_credentials():
@@ -210,26 +108,44 @@ da_date_string = da_date.strftime("%Y-%m-%d")
 site = infer_site(filename)
 
 #### run time
+@profiled
 def run_local():
     if not is_correctFileName(filename):
-            print(f"File {filename} is not correctly named. ABORTING.")
+            log(f"File {filename} is not correctly named. ABORTING.", severity='WARNING', filename=filename)
             return
 
-    file_contents_md5 = hashlib.md5(open(filename,'rb').read()).hexdigest()
+    with span('hash', filename=filename):
+        file_contents_md5 = file_md5_hexdigest(file_path)
     
+    credentials = get_bq_credentials()
+    # get_bq_credentials hands back a client already when there is no key file
+    client = credentials if isinstance(credentials, bigquery.Client) else bigquery.Client(project=PROJECT_ID, credentials=credentials)
+    # rerunning a report replaces its rows rather than duplicating them, as in main.run
+    slices = replaceable_slices([(da_date, site)])
+    mirror = get_mirror()
+
     func_2_run = [load_condensed_masterdata, load_service_level_data, load_servicegroup_data, load_forecast_data, load_customer_data]
-    for func in func_2_run:
-        tbl_name, df = func(file_path, da_date, site)
+    # sheets are parsed serially or across HILTON_PARSE_WORKERS processes, whichever finishes first is written first
+    for tbl_name, df in iter_tables(func_2_run, file_path, da_date, site):
         df['upload_utc_dt'] = now_utc
         df['filename'] = filename
         df['file_contents_md5'] = file_contents_md5
         # save to BQ  
-        credentials = get_bq_credentials()
         pandas_gbq.context.credentials = credentials
         pandas_gbq.context.project = PROJECT_ID
         bq_ds_tbl = f'hilton.{tbl_name}'
-        print(f"writing {bq_ds_tbl}")
-        pd.io.gbq.to_gbq(df, bq_ds_tbl, PROJECT_ID, chunksize=100000, reauth=False, if_exists='append')
+        with span('bigquery_load', table=bq_ds_tbl, rows=len(df)):
+            try:
+                if slices:
+                    delete_slices(client, f'{PROJECT_ID}.{bq_ds_tbl}', slices)
+            except NotFound:
+                pass  # to_gbq creates the table on its first load
+            pd.io.gbq.to_gbq(df, bq_ds_tbl, PROJECT_ID, chunksize=100000, reauth=False, if_exists='append')
+        # and to the local mirror, if HILTON_MIRROR_DIR is set, for querying without BigQuery
+        if mirror is not None:
+            if slices:
+                mirror.delete_slices(bq_ds_tbl, slices)
+            mirror.append(bq_ds_tbl, df)
 
 if __name__ == "__main__":
     run_local()
@@ -0,0 +1,223 @@
+import io
+import os
+import uuid
+import fsspec
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from instrumentation import log
+
+#### Declare constants
+# directory of the local mirror. When set, every table loaded into BigQuery is also appended here.
+MIRROR_DIR = os.environ.get('HILTON_MIRROR_DIR', '')
+# "mirror" loads into the local mirror only, in place of BigQuery, e.g. for offline runs and tests.
+BIGQUERY_BACKEND = os.environ.get('HILTON_BIGQUERY', 'bigquery')
+PARTITION_COLUMNS = ['filename_date', 'filename_site']
+
+def to_arrow(source) -> pa.Table:
+    """
+    rows of a load job as arrow: a DataFrame, an arrow table, or the path(s) of parquet files.
+    """
+    if isinstance(source, pa.Table):
+        return source
+    if isinstance(source, pd.DataFrame):
+        return pa.Table.from_pandas(source, preserve_index=False)
+    if isinstance(source, io.IOBase):
+        return pq.read_table(source)
+    paths = [source] if isinstance(source, str) else source
+    tables = []
+    for path in paths:
+        with fsspec.open(path, 'rb') as f:
+            tables.append(pq.read_table(f))
+    return pa.concat_tables(tables)
+
+class LocalMirror:
+    """
+    embedded columnar copy of the hilton tables: one parquet dataset per table on local disk, partitioned
+    like BigQuery by report date and site.
+
+    Files live at {directory}/{tbl_name}/filename_date=YYYY-MM-DD/filename_site={site}/{uuid}.parquet and
+    keep every column, partition columns included. delete_slices() removes partition directories, so a
+    reloaded report replaces its rows here as it does in BigQuery.
+
+    read() needs nothing but pyarrow. query() runs SQL through DuckDB when it is installed, with each
+    table available as hilton.{tbl_name}, so the queries used against BigQuery run locally.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _table_dir(self, bq_ds_tbl: str) -> str:
+        # dataset.table or table
+        return os.path.join(self.directory, bq_ds_tbl.split('.')[-1])
+
+    def _slice_dir(self, bq_ds_tbl: str, filename_date, filename_site: str) -> str:
+        return os.path.join(self._table_dir(bq_ds_tbl), f"filename_date={pd.Timestamp(filename_date):%Y-%m-%d}", f"filename_site={filename_site}")
+
+    def tables(self) -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if os.path.isdir(os.path.join(self.directory, name)))
+
+    def append(self, bq_ds_tbl: str, source) -> int:
+        """
+        append rows to a table, one parquet file per (filename_date, filename_site) slice.
+
+        Args:
+            bq_ds_tbl (str): table as dataset.table or table.
+            source (pd.DataFrame, pa.Table, or str or list): rows, or parquet path(s) as given to a load job.
+
+        Returns:
+            int: rows appended.
+        """
+        table = to_arrow(source)
+        if not set(PARTITION_COLUMNS) <= set(table.column_names):
+            self._write(self._table_dir(bq_ds_tbl), table)
+            return table.num_rows
+        keys = table.select(PARTITION_COLUMNS).to_pandas()
+        for (filename_date, filename_site), indices in keys.groupby(PARTITION_COLUMNS, observed=True, sort=False).indices.items():
+            self._write(self._slice_dir(bq_ds_tbl, filename_date, filename_site), table.take(pa.array(indices)))
+        return table.num_rows
+
+    def _write(self, directory: str, table: pa.Table) -> None:
+        os.makedirs(directory, exist_ok=True)
+        pq.write_table(table, os.path.join(directory, f"{uuid.uuid4().hex}.parquet"))
+
+    def delete_slices(self, bq_ds_tbl: str, slices: list) -> int:
+        """
+        delete the rows of the given report dates and sites, as bq_loader.delete_slices does in BigQuery.
+
+        Returns:
+            int: rows deleted.
+        """
+        fs = fsspec.filesystem('file')
+        deleted = 0
+        for filename_date, filename_site in set(slices):
+            slice_dir = self._slice_dir(bq_ds_tbl, filename_date, filename_site)
+            if fs.exists(slice_dir):
+                deleted += sum(pq.read_metadata(path).num_rows for path in self.files(bq_ds_tbl, [(filename_date, filename_site)]))
+                fs.rm(slice_dir, recursive=True)
+        return deleted
+
+    def files(self, tbl_name: str, slices: list = None) -> list:
+        """
+        parquet files of a table, only those of the given (filename_date, filename_site) slices when given.
+        """
+        if slices is None:
+            directories = [self._table_dir(tbl_name)]
+        else:
+            directories = [self._slice_dir(tbl_name, filename_date, filename_site) for filename_date, filename_site in set(slices)]
+        return sorted(path for directory in directories for path in fsspec.filesystem('file').find(directory) if path.endswith('.parquet'))
+
+    def read(self, tbl_name: str, columns: list = None, slices: list = None) -> pd.DataFrame:
+        """
+        read a table back, pruned to the given slices.
+
+        Args:
+            tbl_name (str): table name, with or without the dataset.
+            columns (list, optional): only these columns. Defaults to all.
+            slices (list, optional): (filename_date, filename_site) pairs. Defaults to every slice.
+
+        Returns:
+            pd.DataFrame: rows of all files. Columns added by later loads, e.g. of incremental tables, are empty
+                in files written before them.
+        """
+        frames = []
+        for path in self.files(tbl_name, slices):
+            names = pq.read_schema(path).names
+            frames.append(pq.read_table(path, columns=None if columns is None else [col for col in columns if col in names]).to_pandas())
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
+
+    def query(self, sql: str) -> pd.DataFrame:
+        """
+        run SQL over the mirror with DuckDB, each table being hilton.{tbl_name}.
+
+        Raises:
+            ImportError: if duckdb is not installed, read() works without it.
+        """
+        import duckdb
+        conn = duckdb.connect()
+        conn.execute("CREATE SCHEMA hilton")
+        for tbl_name in self.tables():
+            pattern = os.path.join(self._table_dir(tbl_name), '**', '*.parquet').replace("'", "''")
+            conn.execute(f"CREATE VIEW hilton.{tbl_name} AS SELECT * FROM read_parquet('{pattern}', union_by_name = true, hive_partitioning = false)")
+        return conn.execute(sql).df()
+
+class MirrorJob:
+    def __init__(self, output_rows: int = None, input_file_bytes: int = None, num_dml_affected_rows: int = None):
+        self.output_rows = output_rows
+        self.input_file_bytes = input_file_bytes
+        self.num_dml_affected_rows = num_dml_affected_rows
+
+    def result(self, timeout: float = None):
+        return self
+
+class MirrorClient:
+    """
+    stand-in for bigquery.Client that loads into a LocalMirror instead, enough for bq_loader and main.
+
+    Tables need no creating, and of queries only the slice DELETEs of bq_loader.delete_slices are
+    supported. Pair it with a sqlite or "none" HILTON_LEDGER.
+    """
+    project = 'local'
+
+    def __init__(self, mirror: LocalMirror):
+        self.mirror = mirror
+
+    def create_table(self, table, exists_ok: bool = False):
+        return table
+
+    def query(self, query: str, job_config=None) -> MirrorJob:
+        if not query.startswith('DELETE FROM'):
+            raise NotImplementedError(f"the local mirror only runs slice DELETEs, use LocalMirror.query: {query}")
+        values = {parameter.name: parameter.value for parameter in job_config.query_parameters}
+        slices = [(values[f'date_{i}'], values[f'site_{i}']) for i in range(len(values) // 2)]
+        return MirrorJob(num_dml_affected_rows=self.mirror.delete_slices(query.split('`')[1], slices))
+
+    def _load(self, source, destination) -> MirrorJob:
+        table = to_arrow(source)
+        self.mirror.append(str(destination), table)
+        return MirrorJob(table.num_rows, table.nbytes)
+
+    def load_table_from_dataframe(self, df, destination, job_config=None) -> MirrorJob:
+        return self._load(df, destination)
+
+    def load_table_from_file(self, file_obj, destination, job_config=None) -> MirrorJob:
+        return self._load(file_obj, destination)
+
+    def load_table_from_uri(self, source_uris, destination, job_config=None) -> MirrorJob:
+        return self._load(source_uris, destination)
+
+_mirrors = {}
+
+def get_mirror(directory: str = None) -> LocalMirror:
+    """
+    mirror in directory, defaults to HILTON_MIRROR_DIR. None when no directory is set.
+    """
+    directory = directory or MIRROR_DIR
+    if not directory:
+        return None
+    if directory not in _mirrors:
+        _mirrors[directory] = LocalMirror(directory)
+        log(f"mirroring loads into {directory}", mirror=directory)
+    return _mirrors[directory]
+
+def mirror_client(directory: str = None) -> MirrorClient:
+    """
+    client for HILTON_BIGQUERY=mirror, loading into the mirror in directory or HILTON_MIRROR_DIR.
+
+    Raises:
+        ValueError: if no mirror directory is set.
+    """
+    mirror = get_mirror(directory)
+    if mirror is None:
+        raise ValueError("HILTON_BIGQUERY=mirror needs HILTON_MIRROR_DIR")
+    return MirrorClient(mirror)
+
+if __name__ == "__main__":
+    # python mirror.py "SELECT filename_site, COUNT(*) FROM hilton.hilton_servicelevel GROUP BY 1"
+    import sys
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(get_mirror().query(sys.argv[1]))
@@ -0,0 +1,180 @@
+import os
+import fsspec
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from schemas import TABLES, ARROW_TYPES, BIGQUERY_TYPES, table_columns
+from instrumentation import log
+
+#### Declare constants
+# business key of each slowly-changing reference table
+SCD_KEYS = {
+    'hilton_masterdata': 'WOW_MATERIAL_CODE',
+    'hilton_servicegroup': 'WOW_MATERIAL_CODE',
+    'hilton_customer': 'CUSTOMER',
+}
+
+# reference tables loaded incrementally, e.g. "hilton_masterdata,hilton_customer". Others are loaded in full.
+INCREMENTAL_TABLES = [tbl_name for tbl_name in os.environ.get('HILTON_INCREMENTAL_TABLES', '').split(',') if tbl_name in SCD_KEYS]
+
+# where the per-site snapshot indexes live, defaults to <bucket>_output/snapshots
+SNAPSHOT_DIR = os.environ.get('HILTON_SNAPSHOT_DIR', '')
+
+# added to incrementally loaded rows. valid_to of a row is the valid_from of the next row with its key.
+SCD_COLUMNS = [
+    ('row_hash', 'int'),
+    ('change_type', 'category'),
+    ('valid_from', 'datetime'),
+]
+
+def scd_arrow_schema(tbl_name: str) -> pa.Schema:
+    return pa.schema([(col, ARROW_TYPES[col_type]) for col, col_type in table_columns(tbl_name) + SCD_COLUMNS])
+
+def scd_bigquery_schema(tbl_name: str) -> list:
+    from google.cloud import bigquery
+    return [bigquery.SchemaField(col, BIGQUERY_TYPES[col_type]) for col, col_type in table_columns(tbl_name) + SCD_COLUMNS]
+
+def row_hashes(df: pd.DataFrame, tbl_name: str) -> np.ndarray:
+    """
+    64-bit hash of every row's sheet columns, computed vectorised.
+
+    Returns:
+        np.ndarray: int64 hashes, one per row.
+    """
+    columns = [col for col, col_type in TABLES[tbl_name]['columns']]
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy().view(np.int64)
+
+def diff_snapshot(df: pd.DataFrame, tbl_name: str, previous: pd.DataFrame = None) -> tuple:
+    """
+    keep only the rows that are new or changed since the previous snapshot, plus a tombstone per removed key.
+
+    Args:
+        df (pd.DataFrame): table as read from today's sheet.
+        tbl_name (str): key in SCD_KEYS.
+        previous (pd.DataFrame, optional): index (key, row_hash) of the last loaded snapshot. Defaults to None,
+            when every row counts as inserted.
+
+    Returns:
+        tuple: (changes, index) where changes holds the rows to load with row_hash, change_type and
+            valid_from, and index is today's (key, row_hash) snapshot index.
+    """
+    key = SCD_KEYS[tbl_name]
+    hashes = row_hashes(df, tbl_name)
+    index = pd.DataFrame({'key': df[key].astype(object).to_numpy(), 'row_hash': hashes})
+
+    if previous is None:
+        changed = np.ones(len(df), dtype=bool)
+        change_type = np.full(len(df), 'insert', dtype=object)
+        removed = pd.Series([], dtype=object)
+    else:
+        changed = ~np.isin(hashes, previous['row_hash'].to_numpy())
+        change_type = np.where(index['key'].isin(previous['key']).to_numpy(), 'update', 'insert')
+        removed = previous.loc[~previous['key'].isin(index['key']), 'key'].drop_duplicates()
+
+    changes = df[changed].copy()
+    # nullable, tombstones have no hash and a float column would round the 64-bit hashes
+    changes['row_hash'] = pd.array(hashes[changed], dtype='Int64')
+    changes['change_type'] = change_type[changed]
+    changes['valid_from'] = changes['filename_date']
+
+    if len(removed):
+        tombstones = pd.DataFrame({key: removed.to_numpy()})
+        tombstones['filename_date'] = df['filename_date'].iloc[0] if len(df) else pd.NaT
+        tombstones['filename_site'] = df['filename_site'].iloc[0] if len(df) else None
+        tombstones['change_type'] = 'delete'
+        tombstones['valid_from'] = tombstones['filename_date']
+        changes = pd.concat([changes, tombstones], ignore_index=True)
+    return (changes, index)
+
+class SnapshotIndex:
+    """
+    (key, row_hash) index of the last loaded snapshot per table and site, kept as small parquet files
+    and cached in-process, so change detection never scans the BigQuery table.
+
+    put() stages a new index, flush() persists staged indexes once their loads succeeded, and
+    discard() drops them after a failure so the next run diffs against the last good snapshot.
+    When only some loads failed, flush(tbl_names) keeps the indexes of the tables that were loaded.
+
+    Other instances flush the same files, so a cached index is only used while the file's version
+    (its GCS generation, or modification time elsewhere) is unchanged. flush() does not overwrite a
+    file another instance replaced since this one read it.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory.rstrip('/')
+        # {(tbl_name, site): (index, version)}
+        self._cache = {}
+        self._staged = {}
+        # version each staged index was diffed against, None when there was no file
+        self._bases = {}
+
+    def _path(self, tbl_name: str, site: str) -> str:
+        return f"{self.directory}/{tbl_name}/{site}.parquet"
+
+    @staticmethod
+    def _version(fs, path: str) -> tuple:
+        """
+        one metadata call identifying the file's current contents, None when it does not exist.
+        """
+        try:
+            info = fs.info(path)
+        except FileNotFoundError:
+            return None
+        return (info.get('generation'), info.get('mtime'), info.get('created'), info.get('size'))
+
+    def get(self, tbl_name: str, site: str) -> pd.DataFrame:
+        """
+        last snapshot index for tbl_name and site, or None before the first incremental load.
+        """
+        key = (tbl_name, site)
+        if key in self._staged:
+            return self._staged[key]
+        fs, path = fsspec.core.url_to_fs(self._path(tbl_name, site))
+        version = self._version(fs, path)
+        self._bases[key] = version
+        if version is None:
+            return None
+        if key not in self._cache or self._cache[key][1] != version:
+            with fs.open(path, 'rb') as f:
+                self._cache[key] = (pq.read_table(f).to_pandas(), version)
+        return self._cache[key][0]
+
+    def put(self, tbl_name: str, site: str, index: pd.DataFrame) -> None:
+        # later files of a batch diff against the staged index, the base stays the version first read
+        self._staged[(tbl_name, site)] = index
+
+    def flush(self, tbl_names: list = None) -> None:
+        """
+        persist the staged indexes, only those of tbl_names when given, and drop the rest.
+        """
+        for (tbl_name, site), index in self._staged.items():
+            if tbl_names is not None and tbl_name not in tbl_names:
+                continue
+            fs, path = fsspec.core.url_to_fs(self._path(tbl_name, site))
+            if self._version(fs, path) != self._bases.get((tbl_name, site)):
+                # another instance flushed since this one diffed, keep its index rather than lose its update
+                log(f"snapshot index of {tbl_name} for {site} changed since it was read, not overwriting it",
+                    severity='WARNING', table=tbl_name, site=site, path=path)
+                self._cache.pop((tbl_name, site), None)
+                continue
+            fs.makedirs(path.rsplit('/', 1)[0], exist_ok=True)
+            with fs.open(path, 'wb') as f:
+                pq.write_table(pa.Table.from_pandas(index, preserve_index=False), f)
+            self._cache[(tbl_name, site)] = (index, self._version(fs, path))
+        self.discard()
+
+    def discard(self) -> None:
+        self._staged = {}
+        self._bases = {}
+
+_snapshot_indexes = {}
+
+def get_snapshot_index(directory: str) -> SnapshotIndex:
+    """
+    SnapshotIndex for directory, kept across warm invocations.
+    """
+    directory = SNAPSHOT_DIR or directory
+    if directory not in _snapshot_indexes:
+        _snapshot_indexes[directory] = SnapshotIndex(directory)
+    return _snapshot_indexes[directory]
@@ -0,0 +1,300 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from instrumentation import span
+
+#### Declare constants
+# column types:
+#   str       free text, read as str, held as arrow-backed strings, arrow string, BigQuery STRING
+#   category  low-cardinality text, read as str, held as pandas category, arrow dictionary, BigQuery STRING
+#   float     read as float64, BigQuery FLOAT64
+#   datetime  parsed as a naive date, BigQuery DATETIME
+#   timestamp timezone aware (UTC), BigQuery TIMESTAMP
+TABLES = {
+    'hilton_masterdata': {
+        'sheet_name': 'Master Data',
+        'usecols': 'D:G',
+        'columns': [
+            ('WOW_MATERIAL_CODE', 'str'),
+            ('MATERIAL_DESCRIPTION', 'str'),
+            ('PRODUCT_SOURCE', 'category'),
+            ('VALUE_ADD_FLAG', 'category'),
+        ],
+        'required': None,
+        'cluster': 'WOW_MATERIAL_CODE',
+    },
+    'hilton_servicelevel': {
+        'sheet_name': 'Service Level Data',
+        'usecols': 'A:W',
+        'columns': [
+            ('SERVICE_GROUP', 'category'),
+            ('PRODUCT_SOURCE', 'category'),
+            ('VALUE_ADD_FLAG', 'category'),
+            ('REASON_CODE', 'category'),
+            ('REASON_DESCRIPTION', 'category'),
+            ('SHORTAGE_QTY', 'float'),
+            ('PROMO_FLAG', 'float'),
+            ('COMMENTS', 'str'),
+            ('STATE', 'category'),
+            ('PLNT', 'category'),
+            ('ITEM', 'str'),
+            ('SOLD_TO_PT', 'str'),
+            ('PURCHASE_ORDER_NO', 'str'),
+            ('SOLD_TO_PARTY', 'str'),
+            ('MATERIAL', 'str'),
+            ('MATERIAL_NUMBER', 'str'),
+            ('CUSTOMER_MATERIAL_NUMBER', 'str'),
+            ('EAN_UPC', 'str'),
+            ('DC_FLAG', 'category'),
+            ('MAT_AV_DT', 'datetime'),
+            ('ORDER_QUANTITY', 'float'),
+            ('DELIVERED_QTY', 'float'),
+            ('DELIVERED_WEIGHT', 'float'),
+        ],
+        # drop useless rows... where ITEM is missing
+        'required': 'ITEM',
+        'cluster': 'MATERIAL_NUMBER',
+    },
+    'hilton_servicegroup': {
+        'sheet_name': 'Service Group',
+        'usecols': 'A:F',
+        'columns': [
+            ('DEPT', 'category'),
+            ('WOW_MATERIAL_CODE', 'str'),
+            ('MATERIAL_DESCRIPTION', 'str'),
+            ('PRODUCT_SOURCE', 'category'),
+            ('SPECIES', 'category'),
+            ('SERVICE_GROUP', 'category'),
+        ],
+        'required': None,
+        'cluster': 'WOW_MATERIAL_CODE',
+    },
+    'hilton_forecast': {
+        'sheet_name': 'Forecast Data',
+        'usecols': 'A:V',
+        'columns': [
+            ('PROMO_FLAG', 'float'),
+            ('PRODUCT_SOURCE', 'category'),
+            ('PLANT', 'category'),
+            ('MATERIAL_NUMBER', 'str'),
+            ('WOWNR', 'str'),
+            ('DESCRIPTION', 'str'),
+            ('PLANT_MATERIAL_STATUS', 'category'),
+            ('DATE', 'datetime'),
+            ('FORECAST', 'float'),
+            ('ACTUAL_SALES', 'float'),
+            ('ACTUAL_TPRP', 'float'),
+            ('LAST_OLD_TPRP', 'float'),
+            ('_1_WEEK_OLD_FORECAST', 'float'),
+            ('_2_WEEKS_OLD_FORECAST', 'float'),
+            ('_3_WEEKS_OLD_FORECAST', 'float'),
+            ('_4_WEEKS_OLD_FORECAST', 'float'),
+            ('_5_WEEKS_OLD_FORECAST', 'float'),
+            ('_1_WEEK_OLD_TPRP', 'float'),
+            ('_2_WEEKS_OLD_TPRP', 'float'),
+            ('_3_WEEKS_OLD_TPRP', 'float'),
+            ('_4_WEEKS_OLD_TPRP', 'float'),
+            ('_5_WEEKS_OLD_TPRP', 'float'),
+        ],
+        # drop useless rows... where MATERIAL_NUMBER is missing
+        'required': 'MATERIAL_NUMBER',
+        'cluster': 'MATERIAL_NUMBER',
+    },
+    'hilton_customer': {
+        'sheet_name': 'Customer Master',
+        'usecols': 'A:Q',
+        'columns': [
+            ('CUSTOMER', 'str'),
+            ('NAME', 'str'),
+            ('STATE', 'category'),
+            ('FAIR_SHARE', 'str'),
+            ('PALLET_HEI', 'str'),
+            ('LOW_CODE', 'str'),
+            ('STORE_SIZE', 'category'),
+            ('STORE_LEAD', 'str'),
+            ('SALES_ORG', 'category'),
+            ('DISTR_CHANNEL', 'category'),
+            ('DIVISION', 'category'),
+            ('SHIP_CONDITIONS', 'category'),
+            ('DEL_PLANT', 'category'),
+            ('DC', 'category'),
+            ('ORDER_COMB', 'str'),
+            ('MAX_PART_D', 'str'),
+            ('PART_DEL_PER_ITEM', 'float'),
+        ],
+        'required': None,
+        'cluster': 'CUSTOMER',
+    },
+}
+
+# every table is partitioned by day of the report date and clustered by site then its 'cluster' key
+PARTITION_COLUMN = 'filename_date'
+
+# added to every table after it is read
+METADATA_COLUMNS = [
+    ('filename_date', 'datetime'),
+    ('filename_site', 'category'),
+    ('upload_utc_dt', 'timestamp'),
+    ('filename', 'category'),
+    ('file_contents_md5', 'category'),
+]
+
+# pandas dtype the str columns are held in: one arrow buffer per column instead of a python object per cell
+STRING_DTYPE = pd.StringDtype('pyarrow')
+
+ARROW_TYPES = {
+    'str': pa.string(),
+    'category': pa.dictionary(pa.int32(), pa.string()),
+    'float': pa.float64(),
+    'int': pa.int64(),
+    'datetime': pa.timestamp('us'),
+    'timestamp': pa.timestamp('us', tz='UTC'),
+}
+
+BIGQUERY_TYPES = {
+    'str': 'STRING',
+    'category': 'STRING',
+    'float': 'FLOAT64',
+    'int': 'INT64',
+    'datetime': 'DATETIME',
+    'timestamp': 'TIMESTAMP',
+}
+
+def table_columns(tbl_name: str) -> list:
+    """
+    every (column, type) of a table as loaded, sheet columns then metadata columns.
+    """
+    return TABLES[tbl_name]['columns'] + METADATA_COLUMNS
+
+def read_excel_args(tbl_name: str) -> dict:
+    """
+    pd.read_excel keyword arguments for a table's sheet.
+
+    Args:
+        tbl_name (str): key in TABLES.
+
+    Returns:
+        dict: names, dtype, parse_dates and usecols.
+    """
+    columns = TABLES[tbl_name]['columns']
+    args = {
+        'names': [col for col, col_type in columns],
+        'dtype': {col: (np.float64 if col_type == 'float' else 'str') for col, col_type in columns if col_type in ('str', 'category', 'float')},
+        'usecols': TABLES[tbl_name]['usecols'],
+    }
+    parse_dates = [col for col, col_type in columns if col_type == 'datetime']
+    if parse_dates:
+        args['parse_dates'] = parse_dates
+    return args
+
+def arrow_schema(tbl_name: str) -> pa.Schema:
+    """
+    pyarrow schema of a table, with dictionary types for the low-cardinality columns.
+    """
+    return pa.schema([(col, ARROW_TYPES[col_type]) for col, col_type in table_columns(tbl_name)])
+
+def bigquery_schema(tbl_name: str) -> list:
+    """
+    explicit BigQuery schema of a table, for LoadJobConfig.schema.
+    """
+    from google.cloud import bigquery
+    return [bigquery.SchemaField(col, BIGQUERY_TYPES[col_type]) for col, col_type in table_columns(tbl_name)]
+
+def bigquery_table(tbl_name: str, table_id: str, schema: list = None, cluster: str = None) -> 'bigquery.Table':
+    """
+    BigQuery table definition, partitioned by day of PARTITION_COLUMN and clustered by filename_site and the table's key.
+
+    Args:
+        tbl_name (str): key in TABLES.
+        table_id (str): project.dataset.table to create.
+        schema (list, optional): SchemaFields. Defaults to bigquery_schema(tbl_name).
+        cluster (str, optional): key clustered on after filename_site. Defaults to the table's cluster.
+    """
+    from google.cloud import bigquery
+    table = bigquery.Table(table_id, schema=schema or bigquery_schema(tbl_name))
+    table.time_partitioning = bigquery.TimePartitioning(type_=bigquery.TimePartitioningType.DAY, field=PARTITION_COLUMN)
+    table.clustering_fields = ['filename_site', cluster or TABLES[tbl_name]['cluster']]
+    return table
+
+def constant_column(value, length: int) -> pd.Categorical:
+    """
+    a column holding value on every row, e.g. the site or filename, as a one-category categorical: one byte per
+    row and a single string, which arrow keeps as a dictionary of one.
+    """
+    return pd.Categorical.from_codes(np.zeros(length, dtype=np.int8), categories=[value])
+
+def set_dtypes(df: pd.DataFrame, tbl_name: str) -> pd.DataFrame:
+    """
+    hold str columns as arrow-backed strings and category columns as categoricals, so the frame converts
+    to the table's arrow_schema without materialising python strings.
+    """
+    for col, col_type in TABLES[tbl_name]['columns']:
+        if col_type == 'str':
+            df[col] = df[col].astype(STRING_DTYPE)
+        elif col_type == 'category':
+            df[col] = df[col].astype('category')
+    return df
+
+def load_table(file_path, tbl_name: str, da_date, site: str, sheet_name: str = None) -> tuple:
+    """
+    read a table's sheet as described in TABLES.
+
+    Args:
+        file_path (str, io.BytesIO or pd.ExcelFile): workbook to read.
+        tbl_name (str): key in TABLES.
+        da_date (datetime.date): date inferred from the filename.
+        site (str): site inferred from the filename.
+        sheet_name (str, optional): Defaults to the table's sheet_name.
+
+    Returns:
+        tuple: (tbl_name, df)
+    """
+    spec = TABLES[tbl_name]
+    with span('parse', table=tbl_name) as metrics:
+        df = pd.read_excel(file_path, sheet_name=sheet_name or spec['sheet_name'], **read_excel_args(tbl_name))
+        if spec['required'] is not None:
+            df = df[df[spec['required']].notna()].reset_index(drop=True)
+        df = set_dtypes(df, tbl_name)
+        df['filename_date'] = da_date
+        df['filename_site'] = constant_column(site, len(df))
+        metrics['rows'] = len(df)
+        metrics['bytes'] = int(df.memory_usage(deep=True).sum())
+    return (tbl_name, df)
+
+def _cell_str(value) -> str:
+    # pandas' openpyxl reader turns whole-number floats into ints before applying dtype=str
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+def frame_from_rows(rows: list, tbl_name: str, da_date, site: str) -> pd.DataFrame:
+    """
+    build a table's DataFrame from raw sheet rows, converted and filtered the way load_table does.
+
+    Args:
+        rows (list): tuples of cell values covering the table's usecols.
+        tbl_name (str): key in TABLES.
+        da_date (datetime.date): date inferred from the filename.
+        site (str): site inferred from the filename.
+
+    Returns:
+        pd.DataFrame: converted rows.
+    """
+    spec = TABLES[tbl_name]
+    columns = spec['columns']
+    df = pd.DataFrame.from_records(rows, columns=[col for col, col_type in columns])
+    # blank rows inside the used range carry no data
+    df = df.dropna(how='all')
+    for col, col_type in columns:
+        if col_type == 'float':
+            df[col] = pd.to_numeric(df[col]).astype(np.float64)
+        elif col_type == 'datetime':
+            df[col] = pd.to_datetime(df[col])
+        else:
+            df[col] = df[col].map(_cell_str, na_action='ignore').astype(object)
+    if spec['required'] is not None:
+        df = df[df[spec['required']].notna()].reset_index(drop=True)
+    df = set_dtypes(df, tbl_name)
+    df['filename_date'] = da_date
+    df['filename_site'] = constant_column(site, len(df))
+    return df
@@ -0,0 +1,53 @@
+"""
+Fixtures that run main.run() and main.run_batch() end to end against the in-memory GCS and BigQuery
+stand-ins of benchmarks/fakes.py, on small synthetic workbooks.
+"""
+import os
+import sys
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+
+import pytest
+import main
+import ledger
+import scd
+from fakes import fake_cloud, FakeStorageClient, FakeBigQueryClient
+from synthetic_workbook import generate_workbook
+
+BUCKET = 'reports'
+REFERENCE_ROWS = 50
+
+@pytest.fixture
+def cloud(monkeypatch):
+    """
+    fake GCS and BigQuery with a fresh in-memory ledger and no snapshot indexes cached from other tests.
+    """
+    monkeypatch.setattr(ledger, 'LEDGER_BACKEND', ':memory:')
+    monkeypatch.setattr(ledger, '_ledger', None)
+    monkeypatch.setattr(scd, '_snapshot_indexes', {})
+    with fake_cloud(main):
+        yield
+
+@pytest.fixture(scope='session')
+def workbook_path(tmp_path_factory) -> str:
+    return generate_workbook(str(tmp_path_factory.mktemp('reports')), report_date=datetime(2022, 3, 16),
+                             rows=300, reference_rows=REFERENCE_ROWS)
+
+@pytest.fixture
+def upload_event(cloud):
+    """
+    put a workbook (or raw bytes under a name) in the fake upload bucket and return its GCS event.
+    """
+    def upload(path: str, data: bytes = None) -> dict:
+        blob = FakeStorageClient().bucket(BUCKET).blob(os.path.basename(path))
+        if data is None:
+            blob.upload_from_filename(path)
+        else:
+            blob.upload_from_string(data)
+        return {'name': os.path.basename(path), 'bucket': BUCKET}
+    return upload
+
+def loaded_rows(tbl_name: str) -> int:
+    return sum(table.num_rows for table in FakeBigQueryClient.tables.get(f'hilton.{tbl_name}', []))
@@ -0,0 +1,38 @@
+import json
+import os
+import shutil
+import pytest
+import backfill
+from mirror import LocalMirror, MirrorClient
+
+@pytest.fixture
+def local_mirror(monkeypatch, tmp_path) -> LocalMirror:
+    mirror = LocalMirror(str(tmp_path / 'mirror'))
+    monkeypatch.setattr(backfill, 'get_bq_client', lambda: MirrorClient(mirror))
+    return mirror
+
+def test_bad_workbooks_do_not_stop_backfill(local_mirror, tmp_path, workbook_path):
+    reports = tmp_path / 'reports'
+    reports.mkdir()
+    shutil.copy(workbook_path, reports)
+    (reports / 'Heathwood Service Level Report - 17032022.xlsx').write_bytes(b'not a workbook')
+    shutil.copy(workbook_path, reports / 'Heathwood Service Level Report FINAL.xlsx')
+    manifest = tmp_path / 'manifest.jsonl'
+
+    backfill.backfill([str(reports)], workers=1, manifest=str(manifest))
+
+    assert len(local_mirror.read('hilton_servicelevel')) == 300
+    # only the good report is done, the corrupt one is tried again next time
+    assert [json.loads(line)['filename'] for line in manifest.read_text().splitlines()] == [os.path.basename(workbook_path)]
+
+def test_backfill_loads_derived_tables(local_mirror, tmp_path, workbook_path):
+    reports = tmp_path / 'reports'
+    reports.mkdir()
+    shutil.copy(workbook_path, reports)
+
+    backfill.backfill([str(reports)], workers=1, manifest=str(tmp_path / 'manifest.jsonl'))
+    backfill.backfill([str(reports)], workers=1, manifest=str(tmp_path / 'rerun.jsonl'))
+
+    # a rerun replaces the report's summary rows as it replaces its hilton_* rows
+    fill_rate = local_mirror.read('hilton_kpi_fill_rate')
+    assert fill_rate['LINES'].sum() == 300
@@ -0,0 +1,38 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pytest
+import main
+import workbook
+from archive import write_archive
+from fakes import FakeBigQueryClient
+from schemas import arrow_schema, load_table
+from conftest import loaded_rows
+
+CORRUPT = 'Truganina Service Level Report - 17032022.xlsx'
+
+@pytest.mark.parametrize('stream_tables', [[], ['hilton_servicelevel']])
+def test_corrupt_workbook_does_not_fail_batch(cloud, monkeypatch, upload_event, workbook_path, stream_tables):
+    monkeypatch.setattr(workbook, 'STREAM_TABLES', stream_tables)
+    events = [upload_event(workbook_path), upload_event(CORRUPT, b'not a workbook')]
+    main.run_batch(events)
+
+    assert loaded_rows('hilton_servicelevel') == 300
+    fill_rate = pa.concat_tables(FakeBigQueryClient.tables['hilton.hilton_kpi_fill_rate'])
+    assert pc.sum(fill_rate.column('LINES')).as_py() == 300
+
+    # a redelivery skips the good file, which the ledger recorded, and again leaves the corrupt one out
+    main.run_batch(events)
+    assert len(FakeBigQueryClient.tables['hilton.hilton_servicelevel']) == 1
+
+def test_streamed_archives_are_read_back_in_chunks(monkeypatch, tmp_path, workbook_path):
+    filename = os.path.basename(workbook_path)
+    _, df = load_table(workbook_path, 'hilton_servicelevel', main.get_date(filename), main.infer_site(filename))
+    path = write_archive(main.add_upload_columns(df, {'now_utc': pd.Timestamp.now(tz='UTC'), 'filename': filename, 'file_contents_md5': '0' * 32}),
+                         str(tmp_path / 'hilton_servicelevel'), arrow_schema('hilton_servicelevel'))
+    monkeypatch.setattr(workbook, 'CHUNK_ROWS', 64)
+
+    chunks = [chunk for chunk, batch in main.archive_frames(path, 'hilton_servicelevel', chunked=True)]
+    assert max(map(len, chunks)) == 64
+    assert sum(map(len, chunks)) == len(df)
@@ -0,0 +1,111 @@
+import pytest
+import ledger
+import main
+import workbook
+from fakes import FakeBigQueryClient, FakeGCSFileSystem
+from conftest import BUCKET, loaded_rows
+
+LOADS = ['load_table_from_dataframe', 'load_table_from_file', 'load_table_from_uri']
+
+@pytest.fixture
+def fail_once(monkeypatch):
+    """
+    make the next load into each of the given tables fail.
+    """
+    def fail(*tbl_names):
+        failing = {f'hilton.{tbl_name}' for tbl_name in tbl_names}
+        for name in LOADS:
+            load = getattr(FakeBigQueryClient, name)
+            def flaky(self, source, destination, job_config=None, load=load):
+                if str(destination) in failing:
+                    failing.discard(str(destination))
+                    raise RuntimeError(f'{destination} unavailable')
+                return load(self, source, destination, job_config=job_config)
+            monkeypatch.setattr(FakeBigQueryClient, name, flaky)
+    return fail
+
+@pytest.fixture
+def downloads(monkeypatch):
+    calls = []
+    download_to_buffer = main.download_to_buffer
+    def counted(blob):
+        calls.append(blob.name)
+        return download_to_buffer(blob)
+    monkeypatch.setattr(main, 'download_to_buffer', counted)
+    return calls
+
+@pytest.fixture(params=[[], ['hilton_servicelevel']], ids=['whole', 'streamed'])
+def clean_rows(request, monkeypatch, upload_event, workbook_path):
+    """
+    rows per table of one successful run, after which BigQuery and the ledger start empty again.
+    """
+    monkeypatch.setattr(workbook, 'STREAM_TABLES', request.param)
+    main.run(upload_event(workbook_path), None)
+    rows = {destination.split('.')[-1]: loaded_rows(destination.split('.')[-1]) for destination in FakeBigQueryClient.tables}
+    FakeBigQueryClient.tables = {}
+    monkeypatch.setattr(ledger, '_ledger', None)
+    return rows
+
+def checkpoints() -> list:
+    return FakeGCSFileSystem().find(f'/{BUCKET}_output/checkpoints')
+
+def test_retry_loads_only_the_failed_table(clean_rows, fail_once, downloads, upload_event, workbook_path):
+    event = upload_event(workbook_path)
+    fail_once('hilton_forecast')
+    with pytest.raises(RuntimeError, match='hilton_forecast'):
+        main.run(event, None)
+    assert loaded_rows('hilton_forecast') == 0
+    assert len(checkpoints()) == 1
+
+    downloads.clear()
+    main.run(event, None)
+    # every table was archived by the first attempt, so the workbook is neither downloaded nor parsed again
+    assert downloads == []
+    assert {tbl_name: loaded_rows(tbl_name) for tbl_name in clean_rows} == clean_rows
+    # one load job per table: nothing but hilton_forecast was loaded twice
+    assert all(len(tables) == 1 for tables in FakeBigQueryClient.tables.values())
+    assert checkpoints() == []
+
+def test_retry_rebuilds_failed_derived_tables_from_archives(clean_rows, fail_once, upload_event, workbook_path):
+    event = upload_event(workbook_path)
+    fail_once('hilton_forecast', 'hilton_kpi_forecast_accuracy')
+    with pytest.raises(RuntimeError):
+        main.run(event, None)
+
+    main.run(event, None)
+    assert {tbl_name: loaded_rows(tbl_name) for tbl_name in clean_rows} == clean_rows
+    assert len(FakeBigQueryClient.tables['hilton.hilton_servicelevel']) == 1
+
+def test_retry_keeps_skipping_unchanged_sheets(clean_rows, fail_once, monkeypatch, upload_event, workbook_path):
+    monkeypatch.setattr(workbook, 'SKIP_UNCHANGED_TABLES', ['hilton_customer'])
+    # Customer Master is identical to the one loaded last time for the site
+    main.get_ledger().record_sheets('Heathwood', 'earlier.xlsx', workbook.sheet_fingerprints(workbook_path, ['Customer Master']))
+    event = upload_event(workbook_path)
+    fail_once('hilton_forecast')
+    with pytest.raises(RuntimeError):
+        main.run(event, None)
+
+    main.run(event, None)
+    expected = dict(clean_rows, hilton_customer=0)
+    assert {tbl_name: loaded_rows(tbl_name) for tbl_name in clean_rows} == expected
+
+def test_killed_run_keeps_what_finished(clean_rows, monkeypatch, downloads, upload_event, workbook_path):
+    event = upload_event(workbook_path)
+    wait_for_run = main.wait_for_run
+    def killed(loads, archives, upload, derived=None):
+        # the function timeout strikes once every job finished, before wait_for_run saves anything
+        loads.wait()
+        archives.wait()
+        raise TimeoutError('function killed')
+    monkeypatch.setattr(main, 'wait_for_run', killed)
+    with pytest.raises(TimeoutError):
+        main.run(event, None)
+    monkeypatch.setattr(main, 'wait_for_run', wait_for_run)
+    assert len(checkpoints()) == 1
+
+    downloads.clear()
+    main.run(event, None)
+    assert downloads == []
+    # only the derived tables, never recorded by the killed run, are loaded again
+    assert {tbl_name: loaded_rows(tbl_name) for tbl_name in clean_rows} == clean_rows
+    assert all(len(tables) == 1 for destination, tables in FakeBigQueryClient.tables.items() if destination.split('.')[-1] in main.TABLE_LOADERS)
@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from horizons import HORIZONS, HORIZON_COLUMNS, forecast_horizons
+
+def test_forecast_horizons():
+    df = pd.DataFrame({
+        'filename_date': [datetime(2022, 3, 16)] * 2,
+        'filename_site': ['Heathwood'] * 2,
+        'MATERIAL_NUMBER': ['100', '200'],
+        'PLANT': ['1001'] * 2,
+        'PRODUCT_SOURCE': ['LOCAL'] * 2,
+        'DATE': [datetime(2022, 3, 21)] * 2,
+        'upload_utc_dt': [datetime(2022, 3, 16, tzinfo=timezone.utc)] * 2,
+        'file_contents_md5': ['abc'] * 2,
+    })
+    for horizon, forecast_col, tprp_col in HORIZONS:
+        df[forecast_col] = [10.0 * horizon, np.nan]
+        df[tprp_col] = [np.nan, np.nan]
+    # material 200 only has a 2 week old TPRP, material 100 has no 4 week old values at all
+    df.loc[1, '_2_WEEKS_OLD_TPRP'] = 7.0
+    df.loc[0, '_4_WEEKS_OLD_FORECAST'] = np.nan
+
+    long = forecast_horizons(df)
+    assert list(long.columns) == [col for col, col_type in HORIZON_COLUMNS]
+    assert len(long) == 5
+    assert long['HORIZON_WEEKS'].dtype == np.int8
+    assert list(zip(long['MATERIAL_NUMBER'], long['HORIZON_WEEKS'])) == [('100', 1), ('100', 2), ('100', 3), ('100', 5), ('200', 2)]
+    assert long['FORECAST'].tolist()[:4] == [10.0, 20.0, 30.0, 50.0]
+    assert np.isnan(long['FORECAST'].iloc[4]) and long['TPRP'].iloc[4] == 7.0
+
+def test_forecast_horizons_tile_every_row():
+    df = pd.DataFrame({col: ['x'] * 3 if col_type == 'category' else [datetime(2022, 3, 16)] * 3 for col, col_type in HORIZON_COLUMNS[:-3]})
+    for horizon, forecast_col, tprp_col in HORIZONS:
+        df[forecast_col] = 1.0
+        df[tprp_col] = np.nan
+    long = forecast_horizons(df)
+    assert len(long) == 3 * len(HORIZONS)
+    assert long['HORIZON_WEEKS'].tolist() == [1, 2, 3, 4, 5] * 3
@@ -0,0 +1,37 @@
+from datetime import datetime
+import pandas as pd
+import bq_loader
+import main
+import mirror
+from conftest import loaded_rows
+
+def test_unwritable_mirror_does_not_fail_loads(cloud, monkeypatch, tmp_path, upload_event, workbook_path):
+    blocked = tmp_path / 'mirror'
+    blocked.write_text('a file where the mirror directory should be')
+    monkeypatch.setattr(mirror, 'MIRROR_DIR', str(blocked))
+    monkeypatch.setattr(mirror, '_mirrors', {})
+
+    main.run(upload_event(workbook_path), None)
+    assert loaded_rows('hilton_servicelevel') == 300
+
+def test_mirror_replaces_reloaded_slices(cloud, monkeypatch, tmp_path, upload_event, workbook_path):
+    monkeypatch.setattr(mirror, 'MIRROR_DIR', str(tmp_path / 'mirror'))
+    monkeypatch.setattr(mirror, '_mirrors', {})
+    event = upload_event(workbook_path)
+    main.run(event, None)
+    # forget the file so it is loaded again
+    monkeypatch.setattr('ledger._ledger', None)
+    main.run(event, None)
+
+    local = mirror.get_mirror()
+    assert len(local.read('hilton_servicelevel')) == loaded_rows('hilton_servicelevel') == 300
+
+def test_unknown_sites_are_not_replaced(tmp_path, monkeypatch):
+    monkeypatch.setattr(bq_loader, 'REPLACE_SLICES', True)
+    local = mirror.LocalMirror(str(tmp_path))
+    loads = bq_loader.LoadCoordinator(mirror.MirrorClient(local))
+    for filename in ['Service Level Report Dandenong.xlsx', 'Service Level Report Erskine.xlsx']:
+        df = pd.DataFrame({'filename_date': [datetime(2022, 3, 16)], 'filename_site': ['Other'], 'filename': [filename]})
+        loads.submit(df, 'hilton.hilton_kpi', replace=[(datetime(2022, 3, 16), 'Other')])
+        loads.wait()
+    assert sorted(local.read('hilton_kpi')['filename']) == ['Service Level Report Dandenong.xlsx', 'Service Level Report Erskine.xlsx']
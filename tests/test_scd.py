@@ -0,0 +1,81 @@
+import os
+import pandas as pd
+import pytest
+import main
+import scd
+from schemas import load_table
+from conftest import REFERENCE_ROWS, loaded_rows
+
+@pytest.fixture
+def incremental_customer(monkeypatch):
+    monkeypatch.setattr(scd, 'INCREMENTAL_TABLES', ['hilton_customer'])
+
+@pytest.fixture
+def customer_destination_fails(monkeypatch):
+    """
+    make destination() raise for hilton_customer, after incremental_rows has staged its snapshot index.
+    """
+    destination = main.destination
+    def failing(bq_client, tbl_name):
+        if tbl_name == 'hilton_customer':
+            raise RuntimeError('hilton_customer unavailable')
+        return destination(bq_client, tbl_name)
+    monkeypatch.setattr(main, 'destination', failing)
+    return lambda: monkeypatch.setattr(main, 'destination', destination)
+
+def test_failed_batch_leaves_no_staged_snapshot(incremental_customer, customer_destination_fails, upload_event, workbook_path):
+    event = upload_event(workbook_path)
+    with pytest.raises(RuntimeError):
+        main.run_batch([event])
+    customer_destination_fails()
+
+    # the warm process must still diff against no snapshot, not the one staged by the failed batch
+    main.run(event, None)
+    assert loaded_rows('hilton_customer') == REFERENCE_ROWS
+
+def test_failed_run_keeps_no_snapshot_of_unsubmitted_table(incremental_customer, customer_destination_fails, upload_event, workbook_path):
+    event = upload_event(workbook_path)
+    with pytest.raises(RuntimeError):
+        main.run(event, None)
+    customer_destination_fails()
+
+    main.run(event, None)
+    assert loaded_rows('hilton_customer') == REFERENCE_ROWS
+
+def test_tombstones_keep_row_hashes_exact(workbook_path):
+    filename = os.path.basename(workbook_path)
+    _, df = load_table(workbook_path, 'hilton_customer', main.get_date(filename), main.infer_site(filename))
+    changes, previous = scd.diff_snapshot(df, 'hilton_customer')
+
+    # one row changed and one key removed since the previous snapshot
+    today = df.iloc[1:].copy()
+    today.loc[today.index[0], 'NAME'] = 'renamed'
+    changes, index = scd.diff_snapshot(today, 'hilton_customer', previous)
+
+    assert sorted(changes['change_type']) == ['delete', 'update']
+    assert changes['row_hash'].dtype == 'Int64'
+    updated = changes[changes['change_type'] == 'update']
+    assert updated['row_hash'].iloc[0] == index['row_hash'].iloc[0]
+    assert changes.loc[changes['change_type'] == 'delete', 'row_hash'].isna().all()
+
+def test_cached_index_follows_other_instances(tmp_path):
+    index = lambda rows: pd.DataFrame({'key': [str(i) for i in range(rows)], 'row_hash': pd.array(range(rows), dtype='Int64')})
+    first, second = scd.SnapshotIndex(str(tmp_path)), scd.SnapshotIndex(str(tmp_path))
+    first.get('hilton_customer', 'Heathwood')
+    first.put('hilton_customer', 'Heathwood', index(1))
+    first.flush()
+    assert len(second.get('hilton_customer', 'Heathwood')) == 1
+
+    # another instance flushes a newer index, the cached one must not be used any more
+    first.get('hilton_customer', 'Heathwood')
+    first.put('hilton_customer', 'Heathwood', index(2))
+    first.flush()
+    assert len(second.get('hilton_customer', 'Heathwood')) == 2
+
+    # both diffed against the same index, the later flush must not overwrite the earlier one
+    first.get('hilton_customer', 'Heathwood')
+    first.put('hilton_customer', 'Heathwood', index(3))
+    second.put('hilton_customer', 'Heathwood', index(4))
+    first.flush()
+    second.flush()
+    assert len(scd.SnapshotIndex(str(tmp_path)).get('hilton_customer', 'Heathwood')) == 3
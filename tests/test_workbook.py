@@ -0,0 +1,30 @@
+import os
+from datetime import datetime
+import pandas as pd
+import pytest
+import main
+import synthetic_workbook
+from schemas import TABLES, load_table
+from workbook import iter_sheet_chunks
+
+ROWS = 300
+
+@pytest.fixture
+def gappy_workbook_path(monkeypatch, tmp_path) -> str:
+    # plenty of rows without their required column
+    monkeypatch.setattr(synthetic_workbook, 'MISSING_REQUIRED_RATE', 0.2)
+    return synthetic_workbook.generate_workbook(str(tmp_path), report_date=datetime(2022, 3, 16), rows=ROWS, reference_rows=10)
+
+@pytest.mark.parametrize('tbl_name', ['hilton_servicelevel', 'hilton_forecast'])
+def test_streamed_chunks_match_load_table(gappy_workbook_path, tbl_name):
+    filename = os.path.basename(gappy_workbook_path)
+    da_date, site = main.get_date(filename), main.infer_site(filename)
+    _, whole = load_table(gappy_workbook_path, tbl_name, da_date, site)
+    # small chunks, so rows are split across chunk boundaries
+    streamed = pd.concat(iter_sheet_chunks(gappy_workbook_path, tbl_name, da_date, site, chunk_rows=64), ignore_index=True)
+
+    # categories differ per chunk, compare the values
+    pd.testing.assert_frame_equal(streamed.astype(object), whole.astype(object))
+    # both drop the rows missing their required column
+    assert len(whole) < ROWS
+    assert streamed[TABLES[tbl_name]['required']].notna().all()
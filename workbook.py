@@ -0,0 +1,187 @@
+import hashlib
+import importlib.util
+import itertools
+import os
+import re
+import zipfile
+from xml.etree import ElementTree
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from schemas import TABLES, frame_from_rows
+
+#### Declare constants
+# fastest first. calamine needs pandas >= 2.2 and the python-calamine package.
+PREFERRED_ENGINES = ["calamine", "openpyxl"]
+
+# worker processes used to parse sheets. 1 keeps the single-pass serial read.
+PARSE_WORKERS = int(os.environ.get('HILTON_PARSE_WORKERS', '1'))
+
+# tables streamed in row chunks instead of read whole, e.g. "hilton_servicelevel,hilton_forecast".
+STREAM_TABLES = [tbl_name for tbl_name in os.environ.get('HILTON_STREAM_TABLES', '').split(',') if tbl_name]
+CHUNK_ROWS = int(os.environ.get('HILTON_CHUNK_ROWS', '50000'))
+
+# tables skipped when their sheet is identical to the one last loaded for the site, e.g. "hilton_masterdata,hilton_customer".
+SKIP_UNCHANGED_TABLES = [tbl_name for tbl_name in os.environ.get('HILTON_SKIP_UNCHANGED_TABLES', '').split(',') if tbl_name]
+
+# raw <si> entries of xl/sharedStrings.xml, and the shared string index of each t="s" cell of a worksheet
+SHARED_STRING = re.compile(rb'<(?:\w+:)?si(?:\s*/>|>(.*?)</(?:\w+:)?si>)', re.S)
+SHARED_STRING_CELL = re.compile(rb'<(?:\w+:)?c\b[^>]*\bt="s"[^>]*>\s*<(?:\w+:)?v>(\d+)<')
+
+ENGINE_MODULES = {
+    'calamine': 'python_calamine',
+    'openpyxl': 'openpyxl',
+}
+
+def available_engines() -> list:
+    """
+    list the excel engines that can be imported here, fastest first.
+
+    Returns:
+        list: engine names usable with pd.ExcelFile.
+    """
+    return [engine for engine in PREFERRED_ENGINES if importlib.util.find_spec(ENGINE_MODULES[engine]) is not None]
+
+def open_workbook(file_path, engine: str = None) -> pd.ExcelFile:
+    """
+    open a workbook once so every sheet loader can share it.
+
+    The zip is opened and the shared-strings table parsed a single time. The returned
+    pd.ExcelFile can be handed to the load_* functions in place of file_path, since
+    pd.read_excel accepts an ExcelFile and applies the same usecols/names/dtype/parse_dates.
+    openpyxl is opened read-only (streaming rows) by pandas.
+
+    Args:
+        file_path (str or file-like): path to, or buffer holding, the .xlsx file.
+        engine (str, optional): excel engine to use. Defaults to the fastest available.
+
+    Returns:
+        pd.ExcelFile: open workbook. Use as a context manager to close it.
+    """
+    if engine is not None:
+        return pd.ExcelFile(file_path, engine=engine)
+
+    engines = available_engines()
+    for engine in engines[:-1]:
+        try:
+            return pd.ExcelFile(file_path, engine=engine)
+        except (ValueError, ImportError):
+            # older pandas does not know this engine, fall through to the next one.
+            if hasattr(file_path, 'seek'):
+                file_path.seek(0)
+    return pd.ExcelFile(file_path, engine=engines[-1] if engines else None)
+
+def sheet_fingerprints(file_path, sheet_names: list = None) -> dict:
+    """
+    md5 of each worksheet, hashed straight from its XML part in the xlsx zip without parsing any cells.
+
+    The shared strings a sheet references and the styles part (number formats decide which cells
+    read as dates) are folded into its fingerprint, so two fingerprints only match when the sheet
+    would parse to the same rows.
+
+    Args:
+        file_path (str or io.BytesIO): path to, or buffer holding, the .xlsx file.
+        sheet_names (list, optional): sheets to fingerprint. Defaults to all of them.
+
+    Returns:
+        dict: {sheet_name: hex digest}
+    """
+    if hasattr(file_path, 'seek'):
+        file_path.seek(0)
+    fingerprints = {}
+    with zipfile.ZipFile(file_path) as zf:
+        parts = set(zf.namelist())
+        targets = {rel.get('Id'): rel.get('Target') for rel in ElementTree.fromstring(zf.read('xl/_rels/workbook.xml.rels'))}
+        shared = SHARED_STRING.findall(zf.read('xl/sharedStrings.xml')) if 'xl/sharedStrings.xml' in parts else []
+        styles = hashlib.md5(zf.read('xl/styles.xml')).digest() if 'xl/styles.xml' in parts else b''
+        for sheet in ElementTree.fromstring(zf.read('xl/workbook.xml')).iter():
+            if not sheet.tag.endswith('}sheet') or (sheet_names is not None and sheet.get('name') not in sheet_names):
+                continue
+            rel_id = next(value for key, value in sheet.attrib.items() if key.endswith('}id'))
+            target = targets[rel_id]
+            xml = zf.read(target.lstrip('/') if target.startswith('/') else 'xl/' + target)
+            md5 = hashlib.md5(xml)
+            md5.update(styles)
+            md5.update(b'\0'.join(shared[int(index)] for index in SHARED_STRING_CELL.findall(xml)))
+            fingerprints[sheet.get('name')] = md5.hexdigest()
+    if hasattr(file_path, 'seek'):
+        file_path.seek(0)
+    return fingerprints
+
+def _parse_sheet(func, file_path, da_date, site: str, engine: str = None) -> tuple:
+    # runs inside a worker process, so it opens its own copy of the workbook.
+    with open_workbook(file_path, engine=engine) as workbook:
+        return func(workbook, da_date, site)
+
+def iter_tables(func_2_run: list, file_path, da_date, site: str, max_workers: int = None, engine: str = None):
+    """
+    parse each sheet with its load_* function and yield the results as they finish.
+
+    With max_workers > 1 every loader runs in its own worker process and (tbl_name, df) pairs
+    are yielded in completion order, so writes for a finished sheet can start while the big
+    sheets are still parsing. Otherwise the workbook is opened once and parsed serially.
+
+    Args:
+        func_2_run (list): load_* functions, each returning (tbl_name, df).
+        file_path (str or io.BytesIO): path to, or buffer holding, the .xlsx file.
+        da_date (datetime.date): date inferred from the filename.
+        site (str): site inferred from the filename.
+        max_workers (int, optional): pool size. Defaults to HILTON_PARSE_WORKERS.
+        engine (str, optional): excel engine. Defaults to the fastest available.
+
+    Yields:
+        tuple: (tbl_name, df) for each loader.
+    """
+    if not func_2_run:
+        # nothing to parse, e.g. a resumed file whose sheets were all archived, so the workbook is not opened
+        return
+    if max_workers is None:
+        max_workers = PARSE_WORKERS
+    max_workers = min(max_workers, len(func_2_run))
+
+    if max_workers <= 1:
+        with open_workbook(file_path, engine=engine) as workbook:
+            for func in func_2_run:
+                yield func(workbook, da_date, site)
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(_parse_sheet, func, file_path, da_date, site, engine) for func in func_2_run]
+        for future in as_completed(futures):
+            yield future.result()
+
+def iter_sheet_chunks(file_path, tbl_name: str, da_date, site: str, chunk_rows: int = None):
+    """
+    stream a table's sheet in row chunks so memory stays flat however long the sheet is.
+
+    Rows come straight from openpyxl's read-only parser and each chunk is converted and
+    filtered like schemas.load_table before the next one is read.
+
+    Args:
+        file_path (str or io.BytesIO): path to, or buffer holding, the .xlsx file.
+        tbl_name (str): key in schemas.TABLES.
+        da_date (datetime.date): date inferred from the filename.
+        site (str): site inferred from the filename.
+        chunk_rows (int, optional): rows per chunk. Defaults to HILTON_CHUNK_ROWS.
+
+    Yields:
+        pd.DataFrame: up to chunk_rows rows of the table.
+    """
+    from openpyxl import load_workbook
+    from openpyxl.utils import range_boundaries
+
+    if chunk_rows is None:
+        chunk_rows = CHUNK_ROWS
+    spec = TABLES[tbl_name]
+    min_col, _, max_col, _ = range_boundaries(spec['usecols'])
+
+    wb = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        # first row holds the sheet's own headers, the names come from the registry
+        rows = wb[spec['sheet_name']].iter_rows(min_row=2, min_col=min_col, max_col=max_col, values_only=True)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_rows))
+            if not chunk:
+                break
+            yield frame_from_rows(chunk, tbl_name, da_date, site)
+    finally:
+        wb.close()